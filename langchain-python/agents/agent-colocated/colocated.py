@@ -0,0 +1,127 @@
+"""Mount the coordinator and the knowledge base agents in a single app.
+
+Both agents name their package `agent`: each one is imported from the folder
+of its app, then renamed to `coordinator_agent` and `knowledge_base_agent`, so
+that both can be loaded in the same process. The agents then call each other
+in process, instead of through HTTP (see `set_local_runnable`).
+"""
+import importlib
+from pathlib import Path
+import sys
+from typing import Dict, List
+
+from fastapi import FastAPI, HTTPException, Request
+from langchain_core.runnables import Runnable
+from langserve import add_routes
+
+
+AGENTS_DIR = Path(__file__).resolve().parent.parent
+
+
+def import_agent(folder: str, package: str, modules: List[str]):
+    """Import modules of the `agent` package of an app, renamed to `package`."""
+    # Only the folder of the app may provide the `agent` namespace package
+    path = sys.path
+    sys.path = [str(AGENTS_DIR / folder)] + [
+        p for p in path if not (Path(p or ".") / "agent").is_dir()
+    ]
+    try:
+        for module in modules:
+            importlib.import_module(f"agent.{module}")
+    finally:
+        sys.path = path
+
+    for name in [n for n in sys.modules if n == "agent" or n.startswith("agent.")]:
+        sys.modules[package + name[len("agent") :]] = sys.modules.pop(name)
+
+
+import_agent(
+    "agent-coordinator",
+    "coordinator_agent",
+    ["coordinator", "history", "remote", "retries", "tools.knowledge_base"],
+)
+import_agent(
+    "agent-knowledge-base",
+    "knowledge_base_agent",
+    ["knowledge_base", "remote", "retries"],
+)
+
+from coordinator_agent import auth as coordinator_auth  # noqa: E402
+from coordinator_agent import remote as coordinator_remote  # noqa: E402
+from coordinator_agent.history import SESSION_CACHE, SESSION_WRITER  # noqa: E402
+from coordinator_agent.retries import RETRY_STATS as COORDINATOR_RETRIES  # noqa: E402
+from coordinator_agent.tools.knowledge_base import KNOWLEDGE_BASE_CACHE  # noqa: E402
+from knowledge_base_agent import auth as knowledge_base_auth  # noqa: E402
+from knowledge_base_agent import remote as knowledge_base_remote  # noqa: E402
+from knowledge_base_agent.retries import (  # noqa: E402
+    RETRY_STATS as KNOWLEDGE_BASE_RETRIES,
+)
+
+
+def per_req_config_modifier(config: Dict, request: Request) -> Dict:
+    """Modify the config for each request."""
+    config["configurable"] = {}
+    authorization_token = request.headers.get("authorization")
+    if authorization_token:
+        config["configurable"]["authorization_token"] = authorization_token
+    else:
+        raise HTTPException(403, "Invalid authorization token")
+
+    return config
+
+
+def create_app(coordinator: Runnable, knowledge_base: Runnable) -> FastAPI:
+    """Create an app serving both agents, calling each other in process.
+
+    The coordinator is served at the root, as by its own app, and the knowledge
+    base under `/knowledge-base`.
+    """
+    coordinator_remote.set_local_runnable("knowledge-base", knowledge_base)
+    knowledge_base_remote.set_local_runnable("coordinator", coordinator)
+
+    app = FastAPI(
+        title="Demo agents",
+        description="This is the demo agent coordinator and knowledge base, "
+        "served together.",
+        version="1.0.0",
+    )
+
+    add_routes(
+        app,
+        coordinator,
+        per_req_config_modifier=per_req_config_modifier,
+        enabled_endpoints=["invoke", "stream", "stream_events"],
+    )
+    add_routes(
+        app,
+        knowledge_base,
+        path="/knowledge-base",
+        per_req_config_modifier=per_req_config_modifier,
+        enabled_endpoints=["invoke", "stream", "stream_events"],
+    )
+
+    @app.get("/stats")
+    def stats() -> Dict:
+        """Get the stats of the calls between the agents, retries and sessions."""
+        return {
+            "coordinator": {
+                "connections": coordinator_remote.get_connection_stats(),
+                "id_tokens": coordinator_auth.ID_TOKENS.stats(),
+                "retries": COORDINATOR_RETRIES.to_dict(),
+                "knowledge_base_cache": KNOWLEDGE_BASE_CACHE.stats(),
+                "sessions": SESSION_CACHE.stats(),
+                "session_writes": SESSION_WRITER.stats(),
+            },
+            "knowledge_base": {
+                "connections": knowledge_base_remote.get_connection_stats(),
+                "id_tokens": knowledge_base_auth.ID_TOKENS.stats(),
+                "retries": KNOWLEDGE_BASE_RETRIES.to_dict(),
+            },
+        }
+
+    @app.on_event("shutdown")
+    def flush_sessions():
+        """Write the sessions still queued before the instance stops."""
+        SESSION_WRITER.flush()
+
+    return app
@@ -0,0 +1,29 @@
+"""Berry RAG agents, served together."""
+import os
+
+from colocated import create_app
+from coordinator_agent.coordinator import get_agent_coordinator
+from knowledge_base_agent.knowledge_base import get_agent_knowledge_base
+
+
+PORT = int(os.getenv("AIP_HTTP_PORT", "8080"))
+
+
+app = create_app(get_agent_coordinator(), get_agent_knowledge_base())
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    os.environ.update(
+        {
+            "_LOCAL": "1",
+        }
+    )
+
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",  # nosec - Listen to all interfaces
+        port=PORT,
+        reload=True,
+    )
@@ -0,0 +1,142 @@
+"""Authorization utilities."""
+import base64
+from concurrent.futures import Future
+from contextvars import ContextVar
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import google.auth.transport.requests
+import google.oauth2.id_token
+
+
+# Authorization header of the request being processed, set from the run config
+AUTHORIZATION_TOKEN: ContextVar[str] = ContextVar("authorization_token")
+
+ID_TOKEN_REFRESH_MARGIN = float(os.environ.get("_ID_TOKEN_REFRESH_MARGIN", "300"))
+ID_TOKEN_MIN_VALIDITY = float(os.environ.get("_ID_TOKEN_MIN_VALIDITY", "30"))
+
+
+def get_token_expiry(token: str) -> float:
+    """Get the expiry timestamp of a JWT, without verifying it."""
+    payload = token.split(".")[1]
+    payload += "=" * (-len(payload) % 4)
+    return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+
+
+class IDTokenCache:
+    """Cache of ID tokens per audience, refreshed before they expire.
+
+    A token is returned from the cache until it gets within `refresh_margin`
+    seconds of its expiry, or half its lifetime for short-lived tokens: a
+    refresh is then started in the background while the cached token keeps
+    being used. A timer also starts that refresh without
+    waiting for a request. Only a token with less than `min_validity` seconds
+    left is refreshed in the foreground. Concurrent refreshes of the same
+    audience share a single fetch.
+    """
+
+    def __init__(
+        self,
+        fetch: Optional[Callable[[str], str]] = None,
+        refresh_margin: float = ID_TOKEN_REFRESH_MARGIN,
+        min_validity: float = ID_TOKEN_MIN_VALIDITY,
+    ):
+        """Initialize the cache."""
+        self.fetch = fetch or self._fetch_from_metadata_server
+        self.refresh_margin = refresh_margin
+        self.min_validity = min_validity
+        self.hits = 0
+        self.fetches = 0
+        self.background_refreshes = 0
+        self.errors = 0
+        self._tokens: Dict[str, Tuple[str, float, float]] = {}
+        self._pending: Dict[str, Future] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._request = None
+        self._lock = threading.Lock()
+
+    def _fetch_from_metadata_server(self, audience: str) -> str:
+        if self._request is None:
+            self._request = google.auth.transport.requests.Request()
+        return google.oauth2.id_token.fetch_id_token(self._request, audience)
+
+    def get(self, audience: str) -> str:
+        """Get a valid ID token for an audience."""
+        now = time.time()
+        with self._lock:
+            token, expiry, refresh_at = self._tokens.get(audience, (None, 0.0, 0.0))
+            if now < expiry - self.min_validity:
+                self.hits += 1
+                refresh = now >= refresh_at
+            else:
+                token = None
+
+        if token is None:
+            return self._refresh(audience).result()
+        if refresh:
+            self.refresh_in_background(audience)
+        return token
+
+    def refresh_in_background(self, audience: str):
+        """Start refreshing the token of an audience, unless already refreshing."""
+        with self._lock:
+            if audience in self._pending:
+                return
+            self.background_refreshes += 1
+        threading.Thread(target=self._refresh, args=(audience,), daemon=True).start()
+
+    def _refresh(self, audience: str) -> Future:
+        with self._lock:
+            future = self._pending.get(audience)
+            if future is not None:
+                return future
+            future = self._pending[audience] = Future()
+
+        try:
+            token = self.fetch(audience)
+            expiry = get_token_expiry(token)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                del self._pending[audience]
+            future.set_exception(e)
+            return future
+
+        now = time.time()
+        refresh_at = max(expiry - self.refresh_margin, now + (expiry - now) / 2)
+        with self._lock:
+            self.fetches += 1
+            self._tokens[audience] = (token, expiry, refresh_at)
+            del self._pending[audience]
+            if audience in self._timers:
+                self._timers[audience].cancel()
+            timer = self._timers[audience] = threading.Timer(
+                max(refresh_at - now, 0),
+                self.refresh_in_background,
+                (audience,),
+            )
+            timer.daemon = True
+            timer.start()
+        future.set_result(token)
+        return future
+
+    def stats(self) -> dict:
+        """Get the number of tokens served from the cache and fetched."""
+        with self._lock:
+            return {
+                "audiences": len(self._tokens),
+                "hits": self.hits,
+                "fetches": self.fetches,
+                "background_refreshes": self.background_refreshes,
+                "errors": self.errors,
+                "expires_in": {
+                    audience: round(expiry - time.time())
+                    for audience, (_, expiry, _) in self._tokens.items()
+                },
+            }
+
+
+ID_TOKENS = IDTokenCache()
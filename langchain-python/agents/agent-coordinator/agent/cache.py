@@ -0,0 +1,168 @@
+"""Cache of the answers of the knowledge base."""
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from unidecode import unidecode
+
+
+KNOWLEDGE_BASE_CACHE_SIZE = int(os.environ.get("_KNOWLEDGE_BASE_CACHE_SIZE", "1000"))
+KNOWLEDGE_BASE_CACHE_TTL = float(os.environ.get("_KNOWLEDGE_BASE_CACHE_TTL", "3600"))
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query: no accents, folded case and whitespace."""
+    return " ".join(unidecode(query).casefold().split())
+
+
+class _Abandoned(Exception):
+    """The call shared by the callers of a query was cancelled."""
+
+
+class AnswerCache:
+    """LRU cache of answers per normalized query, expiring after `ttl` seconds.
+
+    Concurrent lookups of a query not cached yet share a single call, and its
+    error when it fails. Answers rejected by `accept` are returned, but not
+    cached.
+    """
+
+    def __init__(
+        self,
+        max_size: int = KNOWLEDGE_BASE_CACHE_SIZE,
+        ttl: float = KNOWLEDGE_BASE_CACHE_TTL,
+        accept: Optional[Callable[[Any], bool]] = None,
+    ):
+        """Initialize the cache."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self.accept = accept or (lambda answer: True)
+        self.lookups = 0
+        self.hits = 0
+        self.shared = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: str, retry: bool = False):
+        """Get a cached answer, the call in flight, or start a new one.
+
+        A retry is the lookup of a caller whose call in flight was cancelled:
+        it was already counted, as a shared call.
+        """
+        now = time.time()
+        with self._lock:
+            if retry:
+                self.shared -= 1
+            else:
+                self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, expires_at, latency = entry
+                if now < expires_at:
+                    self.hits += 1
+                    self.saved_seconds += latency
+                    self._entries.move_to_end(key)
+                    return answer, None, False
+                del self._entries[key]
+
+            future = self._pending.get(key)
+            if future is not None:
+                self.shared += 1
+                return None, future, False
+
+            future = self._pending[key] = Future()
+            return None, future, True
+
+    def _store(self, key: str, future: Future, answer: Any, latency: float):
+        with self._lock:
+            del self._pending[key]
+            if self.max_size > 0 and self.accept(answer):
+                self._entries[key] = (answer, time.time() + self.ttl, latency)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        future.set_result(answer)
+
+    def _fail(self, key: str, future: Future, error: BaseException):
+        """Give the error of a call to the callers sharing it.
+
+        A call cancelled, rather than failed, is only abandoned: the callers
+        sharing it look the query up again, and one of them calls `fetch`.
+        """
+        with self._lock:
+            del self._pending[key]
+        if not isinstance(error, Exception):
+            error = _Abandoned()
+        future.set_exception(error)
+
+    def get(self, query: str, fetch: Callable[[], Any]) -> Any:
+        """Get the answer to a query, calling `fetch` when it is not cached."""
+        key = normalize_query(query)
+        retry = False
+        while True:
+            answer, future, leader = self._lookup(key, retry)
+            if future is None:
+                return answer
+            if leader:
+                break
+            try:
+                return future.result()
+            except _Abandoned:
+                retry = True
+
+        start = time.perf_counter()
+        try:
+            answer = fetch()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._store(key, future, answer, time.perf_counter() - start)
+        return answer
+
+    async def aget(self, query: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Get the answer to a query, awaiting `fetch` when it is not cached."""
+        key = normalize_query(query)
+        retry = False
+        while True:
+            answer, future, leader = self._lookup(key, retry)
+            if future is None:
+                return answer
+            if leader:
+                break
+            try:
+                # Shielded, so that cancelling this caller leaves the call to
+                # the others sharing it
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _Abandoned:
+                retry = True
+
+        start = time.perf_counter()
+        try:
+            answer = await fetch()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._store(key, future, answer, time.perf_counter() - start)
+        return answer
+
+    def stats(self) -> dict:
+        """Get the hit rate, and the latency saved per hit."""
+        with self._lock:
+            answered = self.hits + self.shared
+            return {
+                "size": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "shared": self.shared,
+                "calls": self.lookups - answered,
+                "hit_rate": answered / self.lookups if self.lookups else 0.0,
+                "saved_ms_per_hit": (
+                    self.saved_seconds / self.hits * 1000 if self.hits else 0.0
+                ),
+            }
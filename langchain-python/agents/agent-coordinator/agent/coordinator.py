@@ -1,9 +1,8 @@
 """Agent coordinator."""
-from typing import Any, Dict, List, Optional, cast
+from typing import Any, AsyncIterator, Dict, List, Optional, cast
 
 from langchain.agents import AgentExecutor
 from langchain.agents.format_scratchpad import format_to_openai_function_messages
-from langchain.memory import ConversationSummaryBufferMemory
 from langchain.prompts.chat import (
     AIMessagePromptTemplate,
     ChatPromptTemplate,
@@ -12,20 +11,45 @@ from langchain.prompts.chat import (
 )
 from langchain.prompts.prompt import PromptTemplate
 from langchain.pydantic_v1 import BaseModel, Field
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
 from langchain_core.runnables import (
     ConfigurableFieldSpec,
     Runnable,
     RunnableConfig,
+    ensure_config,
 )
-from langchain_core.runnables.utils import Input, Output
+from langchain_core.runnables.utils import AddableDict, Input, Output
+from langchain_core.tools import BaseTool
+from langchain_core.utils.aiter import py_anext
 from langchain_google_vertexai.chat_models import ChatVertexAI
 from unidecode import unidecode
-from vertexai.generative_models._generative_models import ResponseBlockedError
 
 
+from agent.auth import AUTHORIZATION_TOKEN
 from agent.tools.general import get_all_tools
-from agent.history import get_session_history, put_session_data
+from agent.history import (
+    aget_session_history,
+    aput_session_data,
+    get_session_history,
+    put_session_data,
+)
+from agent.memory import aadd_turn, add_turn, get_chat_history
 from agent.output_parser import CustomOutputParser
+from agent.retries import (
+    arun_with_retries,
+    astream_with_retries,
+    run_with_retries,
+)
+from agent.streaming import (
+    ANSWER_TAG,
+    AnswerStream,
+    StreamingChatVertexAI,
+    aiter_input,
+    format_action,
+    format_step,
+)
 
 
 FALLBACK_MESSAGE = (
@@ -66,139 +90,283 @@ def simple_responsible_ai_filter(message: str) -> str:
     return message
 
 
+def check_answer(output: Optional[str]) -> str:
+    """Postprocess the output of the agent, and filter it."""
+    return simple_responsible_ai_filter(postprocess_output(output or ""))
+
+
+def get_chat_prompt() -> ChatPromptTemplate:
+    """Get the prompt of the agent."""
+    return ChatPromptTemplate(
+        input_variables=[
+            "agent_scratchpad",
+            "chat_history",
+            "message",
+        ],
+        messages=[
+            HumanMessagePromptTemplate(
+                prompt=PromptTemplate(
+                    input_variables=[],
+                    template=(
+                        "Your job is to help employees find answers to questions "
+                        "using your knowledge base. You should always use the "
+                        "knowledge base tool.\n"
+                        "You are very open, friendly, and sassy. You are always "
+                        "polite and professional, never aggressive. You must "
+                        "always be helpful and exhaustive. Make employees feel "
+                        "at ease.\n"
+                        "Whenever you are asked to rewrite an answer, you must "
+                        "rewrite the answer exactly as it is written, but in "
+                        "your own words to match your personality. In this case, "
+                        "only answer with the rewritten version."
+                    ),
+                ),
+            ),
+            AIMessagePromptTemplate(
+                prompt=PromptTemplate(
+                    input_variables=[],
+                    template=("Understood!"),
+                )
+            ),
+            MessagesPlaceholder(variable_name="chat_history"),
+            HumanMessagePromptTemplate(
+                prompt=PromptTemplate(
+                    input_variables=["message"],
+                    template="{message}",
+                ),
+            ),
+            MessagesPlaceholder(variable_name="agent_scratchpad"),
+        ],
+    )
+
+
+CHAT_PROMPT = get_chat_prompt()
+
+
+def get_llm() -> ChatVertexAI:
+    """Get the LLM used by the agent."""
+    return StreamingChatVertexAI(
+        model_name="gemini-pro",
+        max_output_tokens=8192,
+        temperature=0.0,
+    )
+
+
+def get_agent(llm: BaseChatModel, tools: List[BaseTool]) -> Runnable:
+    """Get the agent runnable, deciding on the next step."""
+    llm_with_tools = llm.bind(functions=tools).with_config(tags=[ANSWER_TAG])
+
+    return (
+        {
+            "message": lambda x: unidecode(x["message"]),
+            "chat_history": lambda x: x["chat_history"],
+            "agent_scratchpad": lambda x: format_to_openai_function_messages(
+                x.get("checkpoint", []) + x["intermediate_steps"]
+            ),
+        }
+        | CHAT_PROMPT
+        | llm_with_tools
+        | CustomOutputParser(
+            pydantic_schema={tool.name: tool.args_schema for tool in tools},
+        )
+    )
+
+
 class CustomAgentExecutor(Runnable):
     """A custom runnable that will be used by the agent executor."""
 
-    def __init__(self, **kwargs):
-        """Initialize the runnable."""
+    def __init__(self, llm: Optional[BaseChatModel] = None, **kwargs):
+        """Initialize the runnable.
+
+        The prompt, the LLM client and the agent executor are built once and
+        shared by all requests. The tools read the authorization token of the
+        current request from `AUTHORIZATION_TOKEN`, set from the run config.
+        """
         super().__init__(**kwargs)
+        self.llm = llm or get_llm()
+        self.tools = get_all_tools()
+        self.agent_executor = AgentExecutor(
+            agent=get_agent(self.llm, self.tools),
+            tools=self.tools,
+            verbose=True,
+            max_iterations=15,
+            handle_parsing_errors=FALLBACK_MESSAGE,
+            return_intermediate_steps=True,
+        )
 
     def invoke(self, input: Input, config: Optional[RunnableConfig] = None) -> Output:
         """Invoke custom agent."""
         configurable = cast(Dict[str, Any], config.pop("configurable", {}))
+        token = AUTHORIZATION_TOKEN.set(configurable["authorization_token"])
+        try:
+            return self._invoke(input, config)
+        finally:
+            AUTHORIZATION_TOKEN.reset(token)
+
+    async def ainvoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        """Invoke custom agent asynchronously."""
+        configurable = cast(Dict[str, Any], config.pop("configurable", {}))
+        token = AUTHORIZATION_TOKEN.set(configurable["authorization_token"])
+        try:
+            return await self._ainvoke(input, config)
+        finally:
+            AUTHORIZATION_TOKEN.reset(token)
+
+    async def astream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        """Stream the tool calls of the agent and the tokens of its answer."""
+        config = ensure_config(config)
+        configurable = cast(Dict[str, Any], config.pop("configurable", {}))
+        token = AUTHORIZATION_TOKEN.set(configurable["authorization_token"])
+        try:
+            async for chunk in self._atransform_stream_with_config(
+                aiter_input(input), self._astream, config
+            ):
+                yield chunk
+        finally:
+            AUTHORIZATION_TOKEN.reset(token)
+
+    def _save_turn(
+        self,
+        session: dict,
+        turns: List[dict],
+        input: Input,
+        function_messages: List[BaseMessage],
+        answer: str,
+    ):
+        if input["session_id"] == "knowledge-base":
+            return
 
-        tools = get_all_tools(configurable["authorization_token"])
-        chat_prompt = ChatPromptTemplate(
-            input_variables=[
-                "agent_scratchpad",
-                "chat_history",
-                "message",
-            ],
-            messages=[
-                HumanMessagePromptTemplate(
-                    prompt=PromptTemplate(
-                        input_variables=[],
-                        template=(
-                            "Your job is to help employees find answers to questions "
-                            "using your knowledge base. You should always use the "
-                            "knowledge base tool.\n"
-                            "You are very open, friendly, and sassy. You are always "
-                            "polite and professional, never aggressive. You must "
-                            "always be helpful and exhaustive. Make employees feel "
-                            "at ease.\n"
-                            "Whenever you are asked to rewrite an answer, you must "
-                            "rewrite the answer exactly as it is written, but in "
-                            "your own words to match your personality. In this case, "
-                            "only answer with the rewritten version."
-                        ),
-                    ),
-                ),
-                AIMessagePromptTemplate(
-                    prompt=PromptTemplate(
-                        input_variables=[],
-                        template=("Understood!"),
-                    )
-                ),
-                MessagesPlaceholder(variable_name="chat_history"),
-                HumanMessagePromptTemplate(
-                    prompt=PromptTemplate(
-                        input_variables=["message"],
-                        template="{message}",
-                    ),
-                ),
-                MessagesPlaceholder(variable_name="agent_scratchpad"),
-            ],
-        )
-        llm = ChatVertexAI(
-            model_name="gemini-pro",
-            max_output_tokens=8192,
-            temperature=0.0,
+        session, new_turns = add_turn(
+            self.llm, session, turns, input["message"], function_messages, answer
         )
-        llm_with_tools = llm.bind(functions=tools)
+        put_session_data(session, new_turns, input["session_id"])
+
+    async def _asave_turn(
+        self,
+        session: dict,
+        turns: List[dict],
+        input: Input,
+        function_messages: List[BaseMessage],
+        answer: str,
+    ):
+        if input["session_id"] == "knowledge-base":
+            return
 
-        agent = (
-            {
-                "message": lambda x: unidecode(x["message"]),
-                "chat_history": lambda x: x["chat_history"],
-                "agent_scratchpad": lambda x: format_to_openai_function_messages(
-                    x["intermediate_steps"]
-                ),
-            }
-            | chat_prompt
-            | llm_with_tools
-            | CustomOutputParser(
-                pydantic_schema={tool.name: tool.args_schema for tool in tools},
-            )
+        session, new_turns = await aadd_turn(
+            self.llm, session, turns, input["message"], function_messages, answer
         )
+        await aput_session_data(session, new_turns, input["session_id"])
 
-        history, session_conversation = get_session_history(
+    def _invoke(self, input: Input, config: RunnableConfig) -> Output:
+        session, turns = get_session_history(
             session_id=input["session_id"],
         )
-        memory = ConversationSummaryBufferMemory(
-            llm=llm,
-            max_token_limit=8192,
-            chat_memory=history,
-            memory_key="chat_history",
-            output_key="output",
-            return_messages=True,
-        )
+        chat_history = get_chat_history(session, turns)
 
-        agent_executor = AgentExecutor(
-            agent=agent,
-            tools=tools,
-            memory=memory,
-            verbose=True,
-            max_iterations=15,
-            handle_parsing_errors=FALLBACK_MESSAGE,
-            return_intermediate_steps=True,
+        answer, steps = run_with_retries(
+            self.agent_executor,
+            {
+                "message": unidecode(input["message"]),
+                "chat_history": chat_history,
+            },
+            config,
+            check_answer,
+            FALLBACK_MESSAGE,
         )
+        function_messages = format_to_openai_function_messages(steps)
 
-        remaining_tries = 2
-        while remaining_tries > 0:
-            function_messages = []
-            answer = None
-            try:
-                agent_output = agent_executor.invoke(
-                    input={
-                        "message": unidecode(input["message"]),
-                    },
-                    config=config,
-                )
-                function_messages = format_to_openai_function_messages(
-                    agent_output["intermediate_steps"]
-                )
-                answer = postprocess_output(agent_output["output"])
-                answer = simple_responsible_ai_filter(answer)
-            except ResponseBlockedError:
-                answer = FALLBACK_MESSAGE
+        self._save_turn(session, turns, input, function_messages, answer)
 
-            if answer != FALLBACK_MESSAGE:
-                break
+        return {
+            "output": answer,
+        }
 
-            remaining_tries -= 1
+    async def _ainvoke(self, input: Input, config: RunnableConfig) -> Output:
+        session, turns = await aget_session_history(
+            session_id=input["session_id"],
+        )
+        chat_history = get_chat_history(session, turns)
 
-        put_session_data(
-            session_conversation,
-            input["message"],
-            function_messages,
-            answer,
-            input["session_id"],
+        answer, steps = await arun_with_retries(
+            self.agent_executor,
+            {
+                "message": unidecode(input["message"]),
+                "chat_history": chat_history,
+            },
+            config,
+            check_answer,
+            FALLBACK_MESSAGE,
         )
+        function_messages = format_to_openai_function_messages(steps)
+
+        await self._asave_turn(session, turns, input, function_messages, answer)
 
         return {
             "output": answer,
         }
 
+    async def _astream(
+        self,
+        input_iterator: AsyncIterator[Input],
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+    ) -> AsyncIterator[Output]:
+        input = await py_anext(input_iterator)
+        session, turns = await aget_session_history(
+            session_id=input["session_id"],
+        )
+        chat_history = get_chat_history(session, turns)
+        answer_stream = AnswerStream(simple_responsible_ai_filter)
+
+        intermediate_steps = []
+        answer = FALLBACK_MESSAGE
+        async for kind, value in astream_with_retries(
+            self.agent_executor,
+            {"message": unidecode(input["message"]), "chat_history": chat_history},
+            config,
+            run_manager,
+            check_answer,
+            FALLBACK_MESSAGE,
+            # Once part of the answer was sent, it can't be retried
+            can_retry=lambda: not answer_stream.released,
+        ):
+            if kind == "actions":
+                yield AddableDict(actions=[format_action(a) for a in value])
+            elif kind == "steps":
+                intermediate_steps += [(s.action, s.observation) for s in value]
+                yield AddableDict(steps=[format_step(s) for s in value])
+            elif kind == "function_call":
+                answer_stream.on_function_call(value)
+            elif kind == "token":
+                text = answer_stream.on_token(*value)
+                if text:
+                    yield AddableDict(output=text)
+            elif kind == "answer":
+                answer = value
+
+        if answer != FALLBACK_MESSAGE:
+            text = answer_stream.on_answer(answer)
+            if text:
+                yield AddableDict(output=text)
+            answer = answer_stream.released
+        elif answer_stream.released:
+            yield AddableDict(output="\n\n" + FALLBACK_MESSAGE)
+            answer = answer_stream.released + "\n\n" + FALLBACK_MESSAGE
+        else:
+            yield AddableDict(output=FALLBACK_MESSAGE)
+
+        await self._asave_turn(
+            session,
+            turns,
+            input,
+            format_to_openai_function_messages(intermediate_steps),
+            answer,
+        )
+
     @property
     def config_specs(self) -> List[ConfigurableFieldSpec]:
         """Get config specs."""
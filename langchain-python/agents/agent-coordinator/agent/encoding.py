@@ -0,0 +1,93 @@
+"""Compact encoding of the tool calls stored with the turns of a session."""
+import json
+from typing import Any, List
+import zlib
+
+from langchain_core.messages import (
+    AIMessageChunk,
+    BaseMessage,
+    FunctionMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+
+
+# First byte of the encoded tool calls, to change the encoding later on
+TOOLS_ENCODING_VERSION = 1
+
+
+def _encode_message(message: BaseMessage) -> list:
+    if isinstance(message, FunctionMessage):
+        return ["f", message.name, message.content]
+    if isinstance(message, AIMessageChunk):
+        function_call = message.additional_kwargs.get("function_call")
+        if not message.content and message.additional_kwargs == {
+            "function_call": function_call
+        }:
+            return ["c", function_call["name"], function_call["arguments"]]
+        return ["a", message.content, message.additional_kwargs]
+    return ["m", message_to_dict(message)]
+
+
+def _decode_message(record: list) -> BaseMessage:
+    # The records were validated when encoded, so they are not validated again
+    kind = record[0]
+    if kind == "f":
+        return FunctionMessage.construct(name=record[1], content=record[2])
+    if kind == "c":
+        return AIMessageChunk.construct(
+            content="",
+            additional_kwargs={
+                "function_call": {"name": record[1], "arguments": record[2]}
+            },
+        )
+    if kind == "a":
+        return AIMessageChunk.construct(
+            content=record[1], additional_kwargs=record[2]
+        )
+    return messages_from_dict([record[1]])[0]
+
+
+def encode_tools(messages: List[BaseMessage]) -> bytes:
+    """Encode the tool calls of a turn.
+
+    Only the fields that differ between messages are kept, as JSON arrays,
+    compressed with zlib after a version byte.
+    """
+    data = json.dumps(
+        [_encode_message(m) for m in messages],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return bytes([TOOLS_ENCODING_VERSION]) + zlib.compress(data.encode("utf-8"))
+
+
+def _decode_dict(msg: dict) -> BaseMessage:
+    if msg["type"] == "AIMessageChunk":
+        return AIMessageChunk(**msg)
+    return FunctionMessage(**msg)
+
+
+def decode_tools(value: Any) -> List[BaseMessage]:
+    """Decode the tool calls of a turn.
+
+    Turns stored before the encoding hold the dicts of the messages, as a list
+    or as a JSON string.
+    """
+    if not value:
+        return []
+    if isinstance(value, bytes):
+        if value[0] != TOOLS_ENCODING_VERSION:
+            raise ValueError(f"Unknown tools encoding version: {value[0]}")
+        records = json.loads(zlib.decompress(value[1:]))
+        return [_decode_message(record) for record in records]
+
+    if isinstance(value, str):
+        value = json.loads(value)
+        if isinstance(value, str):
+            return []
+    return [
+        _decode_dict(msg)
+        for msg in value
+        if msg["type"] in ("AIMessageChunk", "function")
+    ]
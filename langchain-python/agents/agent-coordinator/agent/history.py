@@ -1,134 +1,415 @@
-"""Datastore utilities."""
+"""Session history utilities."""
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 from datetime import datetime
-from functools import lru_cache
-import json
+import logging
 import os
-from typing import List
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
 
-from google.cloud import datastore
-from langchain.memory import ChatMessageHistory
-from langchain_core.messages import AIMessageChunk, BaseMessage, FunctionMessage
+from agent.encoding import decode_tools, encode_tools
+from agent.store import get_session_store
 
 
-PROJECT_ID = os.environ.get("_PROJECT_ID", "dgc-ml-gemini-autogen")
-DATASTORE_SESSION_ENTITY_NAME = os.environ.get(
-    "_DATASTORE_SESSION_ENTITY_NAME", "session"
-)
+SESSION_CACHE_SIZE = int(os.environ.get("_SESSION_CACHE_SIZE", "1000"))
+SESSION_WRITE_BEHIND = os.environ.get("_SESSION_WRITE_BEHIND", "0") == "1"
+SESSION_WRITER_THREADS = int(os.environ.get("_SESSION_WRITER_THREADS", "4"))
+SESSION_WRITE_RETRIES = int(os.environ.get("_SESSION_WRITE_RETRIES", "5"))
+SESSION_WRITE_BACKOFF = float(os.environ.get("_SESSION_WRITE_BACKOFF", "0.5"))
+# As many as the requests Cloud Run sends to an instance at once by default
+SESSION_IO_THREADS = int(os.environ.get("_SESSION_IO_THREADS", "80"))
 
+logger = logging.getLogger(__name__)
 
-@lru_cache(1)
-def get_datastore_client() -> datastore.Client:
-    """Get a Datastore client."""
-    return datastore.Client(project=PROJECT_ID)
 
+class SessionCache:
+    """LRU cache of the sessions read or written by this instance.
 
-LOCAL_DATABASE = {}
+    An entry holds the summary of a session and its turns not summarized yet,
+    already parsed, at a version of the session. It is only used when the
+    version stored in database is the same, so a session moving between
+    instances is never served stale: a hit still reads the session entity, but
+    not its turns.
+    """
 
+    def __init__(self, max_size: int = SESSION_CACHE_SIZE):
+        """Initialize the cache."""
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.round_trips = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
 
-def get_from_database(session_id: str):
-    """Get session from database."""
-    session = None
-    if os.environ.get("_LOCAL"):
-        print(LOCAL_DATABASE)
-        session = LOCAL_DATABASE.get(session_id)
-    else:
-        ds_client = get_datastore_client()
-        key = ds_client.key(DATASTORE_SESSION_ENTITY_NAME, session_id)
-        session = ds_client.get(key)
+    def count_round_trips(self, count: int = 1):
+        """Count round trips to the database."""
+        with self._lock:
+            self.round_trips += count
 
-    return session
+    def get(self, session_id: str, version: int) -> Optional[Tuple[dict, List[dict]]]:
+        """Get a session at a version, if cached."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                self.stale += entry is not None
+                return None
 
+            self.hits += 1
+            self._entries.move_to_end(session_id)
+            return _copy(entry[1], entry[2])
 
-def put_in_database(session_id, value):
-    """Put in database."""
-    if os.environ.get("_LOCAL"):
-        print(LOCAL_DATABASE)
-        LOCAL_DATABASE[session_id] = value
-    else:
-        ds_client = get_datastore_client()
-        key = ds_client.key(
-            DATASTORE_SESSION_ENTITY_NAME,
+    def put(self, session_id: str, version: int, session: dict, turns: List[dict]):
+        """Cache a session at a version."""
+        if self.max_size <= 0:
+            return
+
+        session, turns = _copy(session, turns)
+        with self._lock:
+            self._entries[session_id] = (version, session, turns)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def update(
+        self, session_id: str, version: int, session: dict, new_turns: List[dict]
+    ):
+        """Write a new version of a cached session through.
+
+        The new turns are added to the cached ones, and the turns now in the
+        summary are dropped. A session not cached at the previous version is
+        left out, as its other turns are not known.
+        """
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is None or entry[0] != version - 1:
+            return
+
+        turns = {t["turn"]: t for t in entry[2]}
+        turns.update({t["turn"]: t for t in new_turns})
+        self.put(
             session_id,
-        )
-        session = datastore.Entity(
-            key,
-            exclude_from_indexes=[
-                "conversation",
+            version,
+            session,
+            [
+                turns[number]
+                for number in sorted(turns)
+                if number > session["summarized_turns"]
             ],
         )
-        session.update(value)
-        ds_client.put(session)
 
+    def stats(self) -> dict:
+        """Get the hit ratio, and the round trips to the database saved per turn.
 
-def get_session_history(session_id: str) -> ChatMessageHistory:
-    """Get session history."""
-    history = ChatMessageHistory()
-    if session_id == "knowledge-base":
-        return history, []
-
-    session = get_from_database(session_id)
-    if session is None:
-        return history, []
-
-    for interaction in session["conversation"]:
-        history.add_user_message(interaction["question"])
-        if "tools" in interaction:
-            if isinstance(interaction["tools"], str):
-                interaction["tools"] = json.loads(interaction["tools"])
-
-            if not isinstance(interaction["tools"], str):
-                for msg in interaction["tools"]:
-                    if msg["type"] == "AIMessageChunk":
-                        history.messages.append(AIMessageChunk(**msg))
-                    elif msg["type"] == "function":
-                        history.messages.append(FunctionMessage(**msg))
-        history.add_ai_message(interaction["answer"])
-
-    return history, session["conversation"]
-
-
-def put_session_data(
-    session_conversation: List[dict],
-    question: str,
-    function_messages: List[BaseMessage],
-    answer: str,
-    session_id: str,
-):
-    """Put session data in Datastore."""
-    if session_id == "knowledge-base":
-        return
+        A turn reads the session entity, then its turns on a miss, and writes
+        them back, so a hit saves one of its three round trips.
+        """
+        with self._lock:
+            turns = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_ratio": self.hits / turns if turns else 0.0,
+                "round_trips": self.round_trips,
+                "round_trips_saved": self.hits,
+                "round_trips_saved_per_turn": self.hits / turns if turns else 0.0,
+            }
 
-    conversation = []
 
-    interactions = session_conversation.copy()
-    interactions.append(
-        {
-            "question": question,
-            "answer": answer,
-            "tools": [m.dict() for m in function_messages],
-        }
-    )
-    for interaction in interactions:
-        value = {
-            "question": interaction["question"],
-            "answer": interaction["answer"],
-            "tools": (
-                interaction["tools"]
-                if isinstance(interaction["tools"], (str, list))
-                else json.dumps(interaction["tools"])
-            ),
-        }
-        if not os.environ.get("_LOCAL"):
-            qa = datastore.Entity(exclude_from_indexes=["question", "answer", "tools"])
-            qa.update(value)
-            value = qa
-
-        conversation.append(value)
-
-    put_in_database(
+def _copy(session: dict, turns: List[dict]) -> Tuple[dict, List[dict]]:
+    return dict(session), [dict(t) for t in turns]
+
+
+SESSION_CACHE = SessionCache()
+
+
+class SessionWriter:
+    """Write sessions in database from a background thread.
+
+    Writes queued for a session before a thread gets to it are coalesced into
+    one: the latest session, with the turns of all of them. The writes of a
+    session are never run at once, so they are stored in order. A failed write
+    is queued again after `backoff` seconds, doubled at every attempt, merged
+    with the writes queued since; its turns are dropped after `retries` retries.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[str, dict, List[dict]], None],
+        threads: int = SESSION_WRITER_THREADS,
+        retries: int = SESSION_WRITE_RETRIES,
+        backoff: float = SESSION_WRITE_BACKOFF,
+    ):
+        """Initialize the writer."""
+        self.write = write
+        self.threads = threads
+        self.retries = retries
+        self.backoff = backoff
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.retried = 0
+        self.dropped_turns = 0
+        # Session id -> (session, turns by number, failed attempts, retry time)
+        self._pending = OrderedDict()
+        self._writing = {}
+        self._condition = threading.Condition()
+        self._started = False
+
+    def put(self, session_id: str, session: dict, turns: List[dict]):
+        """Queue a write of a session."""
+        with self._condition:
+            if session_id in self._pending:
+                _, pending_turns, attempts, retry_at = self._pending[session_id]
+                self.coalesced += 1
+            else:
+                pending_turns, attempts, retry_at = {}, 0, 0.0
+            pending_turns.update({t["turn"]: t for t in turns})
+            self._pending[session_id] = (session, pending_turns, attempts, retry_at)
+
+            if not self._started:
+                self._started = True
+                for _ in range(self.threads):
+                    threading.Thread(target=self._run, daemon=True).start()
+            self._condition.notify_all()
+
+    def get_version(self, session_id: str) -> Optional[int]:
+        """Get the version of a session not written yet, if any."""
+        with self._condition:
+            if session_id in self._pending:
+                return self._pending[session_id][0]["version"]
+            return self._writing.get(session_id)
+
+    def wait(self, session_id: Optional[str] = None):
+        """Wait until a session, or all of them, are written."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: (
+                    session_id not in self._pending and session_id not in self._writing
+                    if session_id is not None
+                    else not self._pending and not self._writing
+                )
+            )
+
+    def flush(self):
+        """Write all the queued sessions, before shutting down."""
+        self.wait()
+
+    def _next(self) -> Tuple[Optional[str], Optional[float]]:
+        """Get a session to write now, or else how long to wait for a retry."""
+        now = time.monotonic()
+        timeout = None
+        for session_id, (*_, retry_at) in self._pending.items():
+            if session_id in self._writing:
+                continue
+            if retry_at <= now:
+                return session_id, None
+            wait = retry_at - now
+            timeout = wait if timeout is None else min(timeout, wait)
+        return None, timeout
+
+    def _run(self):
+        while True:
+            with self._condition:
+                session_id, timeout = self._next()
+                while session_id is None:
+                    self._condition.wait(timeout)
+                    session_id, timeout = self._next()
+                session, turns, attempts, _ = self._pending.pop(session_id)
+                self._writing[session_id] = session["version"]
+
+            try:
+                self.write(session_id, session, [turns[n] for n in sorted(turns)])
+                self.writes += 1
+            except Exception:
+                self._retry(session_id, session, turns, attempts + 1)
+            finally:
+                with self._condition:
+                    del self._writing[session_id]
+                    self._condition.notify_all()
+
+    def _retry(self, session_id: str, session: dict, turns: dict, attempts: int):
+        """Queue a failed write again, or drop it after too many attempts."""
+        with self._condition:
+            self.errors += 1
+            newer = self._pending.get(session_id)
+            if attempts > self.retries:
+                # The cache now differs from the stored version, so the session
+                # is read again from database on its next turn
+                dropped = set(turns) - set(newer[1] if newer else ())
+                self.dropped_turns += len(dropped)
+                logger.exception(
+                    "Dropped %d turns of session %s after %d attempts",
+                    len(dropped),
+                    session_id,
+                    attempts,
+                )
+                return
+
+            self.retried += 1
+            delay = self.backoff * 2 ** (attempts - 1)
+            logger.warning(
+                "Failed to write session %s, retrying in %.1fs",
+                session_id,
+                delay,
+                exc_info=True,
+            )
+            if newer is not None:
+                session, newer_turns, _, _ = newer
+                turns.update(newer_turns)
+            self._pending[session_id] = (
+                session,
+                turns,
+                attempts,
+                time.monotonic() + delay,
+            )
+
+    def stats(self) -> dict:
+        """Get the number of writes, of writes coalesced, retried and dropped."""
+        with self._condition:
+            return {
+                "pending": len(self._pending) + len(self._writing),
+                "writes": self.writes,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "retried": self.retried,
+                "dropped_turns": self.dropped_turns,
+            }
+
+
+def write_session(session_id: str, session: dict, turns: List[dict]):
+    """Write turns of a session, and the session, in the session store."""
+    get_session_store().put(
         session_id,
+        [
+            {
+                "turn": turn["turn"],
+                "question": turn["question"],
+                "answer": turn["answer"],
+                "tools": encode_tools(turn["tools"]),
+                "tokens": turn["tokens"],
+            }
+            for turn in turns
+        ],
         {
-            "conversation": conversation,
+            "summary": session["summary"],
+            "summarized_turns": session["summarized_turns"],
+            "turn_count": session["turn_count"],
+            "version": session["version"],
             "last_message_utc": datetime.utcnow(),
         },
     )
+    SESSION_CACHE.count_round_trips()
+
+
+SESSION_WRITER = SessionWriter(write_session)
+
+
+def get_session_history(session_id: str) -> Tuple[dict, List[dict]]:
+    """Get the summary of a session, and its turns not summarized yet.
+
+    The session holds the running `summary`, the number of turns it covers
+    (`summarized_turns`), the number of turns stored (`turn_count`) and the
+    `version` of the session, incremented at every write.
+    """
+    session = {"summary": "", "summarized_turns": 0, "turn_count": 0, "version": 0}
+    if session_id == "knowledge-base":
+        return session, []
+
+    version = SESSION_WRITER.get_version(session_id)
+    if version is not None:
+        # Read the writes of this instance not stored yet from the cache, or
+        # wait for them
+        cached = SESSION_CACHE.get(session_id, version)
+        if cached is not None:
+            return cached
+        SESSION_WRITER.wait(session_id)
+
+    stored = get_session_store().get_session(session_id)
+    SESSION_CACHE.count_round_trips()
+    if stored is None:
+        SESSION_CACHE.put(session_id, session["version"], session, [])
+        return session, []
+
+    if "conversation" in stored:
+        # Sessions written before turns were stored separately keep all of
+        # them in their conversation, and have no turn entities yet
+        turns = [
+            dict(interaction, turn=number)
+            for number, interaction in enumerate(stored["conversation"], start=1)
+        ]
+    else:
+        session.update(
+            summary=stored.get("summary", ""),
+            summarized_turns=stored.get("summarized_turns", 0),
+            turn_count=stored.get("turn_count", 0),
+            version=stored.get("version", 0),
+        )
+        cached = SESSION_CACHE.get(session_id, session["version"])
+        if cached is not None:
+            return cached
+
+        turns = get_session_store().get_turns(
+            session_id, session["summarized_turns"]
+        )
+        SESSION_CACHE.count_round_trips()
+
+    for turn in turns:
+        turn["tools"] = decode_tools(turn.get("tools"))
+
+    SESSION_CACHE.put(session_id, session["version"], session, turns)
+    return session, turns
+
+
+def put_session_data(session: dict, turns: List[dict], session_id: str):
+    """Put session data in the session store, and in the session cache.
+
+    Only the given turns are written, with the summary of the session, so a
+    turn no longer rewrites the whole conversation. With
+    `SESSION_WRITE_BEHIND`, the write is queued to `SESSION_WRITER` instead,
+    and the cache is updated right away, so that the next turn reads it.
+    """
+    if session_id == "knowledge-base":
+        return
+
+    session = dict(session, version=session["version"] + 1)
+    if SESSION_WRITE_BEHIND:
+        SESSION_CACHE.update(session_id, session["version"], session, turns)
+        SESSION_WRITER.put(session_id, session, turns)
+    else:
+        write_session(session_id, session, turns)
+        SESSION_CACHE.update(session_id, session["version"], session, turns)
+
+
+_SESSION_IO_EXECUTOR = ThreadPoolExecutor(
+    SESSION_IO_THREADS, thread_name_prefix="session-io"
+)
+
+
+async def run_session_io(func: Callable, *args):
+    """Run a blocking call of the session history in its own thread pool.
+
+    The default thread pool of the event loop has `min(32, CPUs + 4)` threads,
+    so 5 on a single CPU instance, which would cap the requests reading or
+    writing their session at once. Up to `SESSION_IO_THREADS` calls run at once
+    here, the next ones wait for a thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_SESSION_IO_EXECUTOR, context.run, func, *args)
+
+
+async def aget_session_history(session_id: str) -> Tuple[dict, List[dict]]:
+    """Get session history, without blocking the event loop."""
+    return await run_session_io(get_session_history, session_id)
+
+
+async def aput_session_data(session: dict, turns: List[dict], session_id: str):
+    """Put session data, without blocking the event loop."""
+    await run_session_io(put_session_data, session, turns, session_id)
@@ -0,0 +1,178 @@
+"""Conversation memory: a running summary and the last turns of a session."""
+import os
+from typing import List, Tuple
+
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    get_buffer_string,
+)
+from langchain_core.output_parsers import StrOutputParser
+
+from agent.history import run_session_io
+
+
+HISTORY_MAX_TURNS = int(os.environ.get("_HISTORY_MAX_TURNS", 10))
+HISTORY_MAX_TOKENS = int(os.environ.get("_HISTORY_MAX_TOKENS", 8192))
+
+
+def make_turn(
+    number: int,
+    question: str,
+    function_messages: List[BaseMessage],
+    answer: str,
+) -> dict:
+    """Make a new turn of a session."""
+    return {
+        "turn": number,
+        "question": question,
+        "answer": answer,
+        "tools": list(function_messages),
+    }
+
+
+def get_turn_messages(turn: dict) -> List[BaseMessage]:
+    """Get the messages of a turn: the question, the tool calls and the answer."""
+    return [
+        HumanMessage(content=turn["question"]),
+        *turn["tools"],
+        AIMessage(content=turn["answer"]),
+    ]
+
+
+def get_chat_history(session: dict, turns: List[dict]) -> List[BaseMessage]:
+    """Get the chat history of the agent: the summary, then the last turns."""
+    chat_history = []
+    if session["summary"]:
+        chat_history += [
+            HumanMessage(
+                content=f"Summary of our conversation so far:\n{session['summary']}"
+            ),
+            AIMessage(content="Understood!"),
+        ]
+    for turn in turns:
+        chat_history += get_turn_messages(turn)
+    return chat_history
+
+
+def count_tokens(llm: BaseChatModel, turn: dict) -> int:
+    """Count the tokens of a turn."""
+    return llm.get_num_tokens(get_buffer_string(get_turn_messages(turn)))
+
+
+def get_overflow(turns: List[dict]) -> int:
+    """Get the number of oldest turns to add to the summary.
+
+    Nothing is summarized until the turns exceed `HISTORY_MAX_TURNS` or
+    `HISTORY_MAX_TOKENS`. Then they are summarized down to half of both limits,
+    so that the summary is only updated every few turns. The last turn is
+    always kept.
+    """
+    tokens = sum(turn["tokens"] for turn in turns)
+    if len(turns) <= HISTORY_MAX_TURNS and tokens <= HISTORY_MAX_TOKENS:
+        return 0
+
+    overflow = 0
+    while overflow < len(turns) - 1 and (
+        len(turns) - overflow > HISTORY_MAX_TURNS // 2
+        or tokens > HISTORY_MAX_TOKENS // 2
+    ):
+        tokens -= turns[overflow]["tokens"]
+        overflow += 1
+    return overflow
+
+
+def get_summary_chain(llm: BaseChatModel):
+    """Get the chain adding lines of a conversation to its summary."""
+    return SUMMARY_PROMPT | llm | StrOutputParser()
+
+
+def _get_summary_input(session: dict, turns: List[dict]) -> dict:
+    messages = [m for turn in turns for m in get_turn_messages(turn)]
+    return {"summary": session["summary"], "new_lines": get_buffer_string(messages)}
+
+
+def _add_turn(
+    session: dict,
+    turns: List[dict],
+    question: str,
+    function_messages: List[BaseMessage],
+    answer: str,
+) -> Tuple[List[dict], List[dict]]:
+    turn = make_turn(
+        session["summarized_turns"] + len(turns) + 1,
+        question,
+        function_messages,
+        answer,
+    )
+    # The turns of a legacy session are not stored as turn entities yet, and
+    # the ones stored without their token count get it once
+    to_write = [
+        t for t in turns if t["turn"] > session["turn_count"] or "tokens" not in t
+    ]
+    return turns + [turn], to_write + [turn]
+
+
+def _update_session(
+    session: dict, turns: List[dict], overflow: int, summary: str
+) -> dict:
+    return dict(
+        session,
+        summary=summary,
+        summarized_turns=(
+            turns[overflow - 1]["turn"] if overflow else session["summarized_turns"]
+        ),
+        turn_count=turns[-1]["turn"],
+    )
+
+
+def add_turn(
+    llm: BaseChatModel,
+    session: dict,
+    turns: List[dict],
+    question: str,
+    function_messages: List[BaseMessage],
+    answer: str,
+) -> Tuple[dict, List[dict]]:
+    """Add a turn to a session, summarizing the oldest turns when they overflow.
+
+    Returns the updated session, and the turns to write.
+    """
+    turns, to_write = _add_turn(session, turns, question, function_messages, answer)
+    for turn in to_write:
+        if "tokens" not in turn:
+            turn["tokens"] = count_tokens(llm, turn)
+
+    overflow = get_overflow(turns)
+    summary = session["summary"]
+    if overflow:
+        summary = get_summary_chain(llm).invoke(
+            _get_summary_input(session, turns[:overflow])
+        )
+    return _update_session(session, turns, overflow, summary), to_write
+
+
+async def aadd_turn(
+    llm: BaseChatModel,
+    session: dict,
+    turns: List[dict],
+    question: str,
+    function_messages: List[BaseMessage],
+    answer: str,
+) -> Tuple[dict, List[dict]]:
+    """Add a turn to a session, without blocking the event loop."""
+    turns, to_write = _add_turn(session, turns, question, function_messages, answer)
+    for turn in to_write:
+        if "tokens" not in turn:
+            turn["tokens"] = await run_session_io(count_tokens, llm, turn)
+
+    overflow = get_overflow(turns)
+    summary = session["summary"]
+    if overflow:
+        summary = await get_summary_chain(llm).ainvoke(
+            _get_summary_input(session, turns[:overflow])
+        )
+    return _update_session(session, turns, overflow, summary), to_write
@@ -0,0 +1,192 @@
+"""Pooled HTTP clients for the calls to the other agents."""
+import asyncio
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.utils import Input, Output
+from langserve import RemoteRunnable
+
+from agent.auth import AUTHORIZATION_TOKEN
+
+
+HTTP2 = os.environ.get("_HTTP2", "1") == "1"
+HTTP_TIMEOUT = float(os.environ.get("_HTTP_TIMEOUT", "300"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("_HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("_HTTP_KEEPALIVE_EXPIRY", "60"))
+
+
+class ConnectionStats:
+    """Count the requests sent to an agent and the connections opened for them."""
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self.http2_requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        """Count a request."""
+        with self._lock:
+            self.requests += 1
+
+    def trace(self, event: str, info: dict):
+        """Count an httpcore trace event."""
+        with self._lock:
+            if event == "connection.connect_tcp.complete":
+                self.connections += 1
+            elif event == "connection.start_tls.complete":
+                self.tls_handshakes += 1
+            elif event == "http2.send_request_headers.started":
+                self.http2_requests += 1
+
+    async def atrace(self, event: str, info: dict):
+        """Count an httpcore trace event, from an async client."""
+        self.trace(event, info)
+
+    def to_dict(self) -> dict:
+        """Get the counters and the share of requests sent on a reused connection."""
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "tls_handshakes": self.tls_handshakes,
+            "http2_requests": self.http2_requests,
+            "reuse_ratio": (
+                1 - self.connections / self.requests if self.requests else 0.0
+            ),
+        }
+
+
+class AgentAuth(httpx.Auth):
+    """Set the authorization header of every request and trace its connection.
+
+    The header is computed when the request is sent, so that a client shared by
+    all the requests of the process still uses the token of the current one.
+    """
+
+    def __init__(self, get_authorization: Callable[[], str], stats: ConnectionStats):
+        """Initialize the auth."""
+        self.get_authorization = get_authorization
+        self.stats = stats
+
+    def sync_auth_flow(self, request: httpx.Request):
+        """Prepare a request of a sync client."""
+        request.headers["Authorization"] = self.get_authorization()
+        request.extensions["trace"] = self.stats.trace
+        self.stats.count_request()
+        yield request
+
+    async def async_auth_flow(self, request: httpx.Request):
+        """Prepare a request of an async client.
+
+        Getting the authorization may wait for an ID token to be fetched, so it
+        runs in a thread, with the context of the request.
+        """
+        request.headers["Authorization"] = await asyncio.to_thread(
+            self.get_authorization
+        )
+        request.extensions["trace"] = self.stats.atrace
+        self.stats.count_request()
+        yield request
+
+
+class LocalRunnable(Runnable):
+    """Call an agent mounted in the same process, without going through HTTP.
+
+    The agent gets the authorization header of the request being processed in
+    its config, as its routes would have when the agents run locally.
+    """
+
+    def __init__(self, runnable: Runnable, stats: ConnectionStats, **kwargs):
+        """Initialize the runnable."""
+        super().__init__(**kwargs)
+        self.runnable = runnable
+        self.stats = stats
+
+    def _get_config(self) -> RunnableConfig:
+        authorization_token = AUTHORIZATION_TOKEN.get(None)
+        if not authorization_token:
+            raise PermissionError("Invalid authorization token")
+
+        self.stats.count_request()
+        return {"configurable": {"authorization_token": authorization_token}}
+
+    def invoke(self, input: Input, config: Optional[RunnableConfig] = None) -> Output:
+        """Invoke the agent."""
+        return self.runnable.invoke(input, self._get_config())
+
+    async def ainvoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        """Invoke the agent asynchronously."""
+        return await self.runnable.ainvoke(input, self._get_config())
+
+
+_REMOTE_RUNNABLES: Dict[str, RemoteRunnable] = {}
+_LOCAL_RUNNABLES: Dict[str, LocalRunnable] = {}
+_STATS: Dict[str, ConnectionStats] = {}
+_LOCK = threading.Lock()
+
+
+def get_remote_runnable(
+    url: str, get_authorization: Callable[[], str]
+) -> RemoteRunnable:
+    """Get the process-wide remote runnable of an agent.
+
+    Its HTTP clients keep their connections alive between requests, and
+    negotiate HTTP/2 with servers supporting it over TLS.
+    """
+    with _LOCK:
+        if url not in _REMOTE_RUNNABLES:
+            _STATS[url] = ConnectionStats()
+            _REMOTE_RUNNABLES[url] = RemoteRunnable(
+                url,
+                timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                auth=AgentAuth(get_authorization, _STATS[url]),
+                client_kwargs={
+                    "http2": HTTP2,
+                    "limits": httpx.Limits(
+                        max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                    ),
+                },
+            )
+        return _REMOTE_RUNNABLES[url]
+
+
+def set_local_runnable(name: str, runnable: Runnable):
+    """Call an agent mounted in the same process, instead of its URL."""
+    with _LOCK:
+        _STATS[f"local:{name}"] = ConnectionStats()
+        _LOCAL_RUNNABLES[name] = LocalRunnable(runnable, _STATS[f"local:{name}"])
+
+
+def get_agent_runnable(
+    name: str, url: str, get_authorization: Callable[[], str]
+) -> Runnable:
+    """Get the runnable of an agent.
+
+    The agent is called in process when it is mounted in the same app (see
+    `set_local_runnable`), and through the remote runnable of its URL otherwise.
+    """
+    with _LOCK:
+        runnable = _LOCAL_RUNNABLES.get(name)
+    if runnable is not None:
+        return runnable
+
+    return get_remote_runnable(url, get_authorization)
+
+
+def get_connection_stats() -> Dict[str, dict]:
+    """Get the connection stats of every agent called so far."""
+    with _LOCK:
+        return {url: stats.to_dict() for url, stats in _STATS.items()}
@@ -0,0 +1,247 @@
+"""Retries of the agent, resuming from the tool calls already made."""
+import asyncio
+import os
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun
+from langchain_core.runnables import RunnableConfig
+from vertexai.generative_models._generative_models import ResponseBlockedError
+
+from agent.streaming import astream_agent
+
+
+# Start the retry while the first attempt still runs, once it takes longer than
+# this many seconds (0 to only retry once the first attempt failed)
+RETRY_HEDGE_AFTER = float(os.environ.get("_RETRY_HEDGE_AFTER", "0"))
+
+Steps = List[Tuple[AgentAction, Any]]
+
+
+def count_llm_calls(steps: Steps) -> int:
+    """Count the model calls that decided on the tool calls of the steps."""
+    calls = set()
+    for action, _ in steps:
+        message_log = getattr(action, "message_log", None)
+        calls.add(id(message_log[0]) if message_log else id(action))
+    return len(calls)
+
+
+class RetryStats:
+    """Count the retried requests, and the calls their checkpoints saved."""
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.retried_requests = 0
+        self.hedged_requests = 0
+        self.hedges_won = 0
+        self.llm_calls_saved = 0
+        self.tool_calls_saved = 0
+        self._lock = threading.Lock()
+
+    def count_retry(self, checkpoint: Steps, hedged: bool = False):
+        """Count a retry resuming from a checkpoint."""
+        with self._lock:
+            self.retried_requests += 1
+            self.hedged_requests += hedged
+            self.llm_calls_saved += count_llm_calls(checkpoint)
+            self.tool_calls_saved += len(checkpoint)
+
+    def count_hedge_won(self):
+        """Count a retry answering before the attempt it hedged."""
+        with self._lock:
+            self.hedges_won += 1
+
+    def to_dict(self) -> dict:
+        """Get the counters, and the calls saved per retried request."""
+        with self._lock:
+            retried = self.retried_requests
+            return {
+                "retried_requests": retried,
+                "hedged_requests": self.hedged_requests,
+                "hedges_won": self.hedges_won,
+                "llm_calls_saved": self.llm_calls_saved,
+                "tool_calls_saved": self.tool_calls_saved,
+                "llm_calls_saved_per_retry": (
+                    self.llm_calls_saved / retried if retried else 0.0
+                ),
+                "tool_calls_saved_per_retry": (
+                    self.tool_calls_saved / retried if retried else 0.0
+                ),
+            }
+
+
+RETRY_STATS = RetryStats()
+
+
+def run_with_retries(
+    agent_executor: AgentExecutor,
+    input: Dict[str, Any],
+    config: RunnableConfig,
+    check: Callable[[str], str],
+    fallback: str,
+    tries: int = 2,
+) -> Tuple[str, Steps]:
+    """Run an agent executor until `check` accepts its answer.
+
+    `check` returns `fallback` for an answer it rejects. A retry resumes from
+    the steps of the previous attempt, given to the agent as its `checkpoint`,
+    so that it doesn't call the model and the tools again for them. Returns the
+    answer, and all the steps taken.
+    """
+    steps = []
+    for attempt in range(tries):
+        checkpoint = list(steps)
+        if attempt:
+            RETRY_STATS.count_retry(checkpoint)
+        try:
+            output = None
+            for chunk in agent_executor.stream(
+                dict(input, checkpoint=checkpoint), config
+            ):
+                if "steps" in chunk:
+                    steps += [(s.action, s.observation) for s in chunk["steps"]]
+                elif "output" in chunk:
+                    output = chunk["output"]
+            answer = check(output)
+        except ResponseBlockedError:
+            answer = fallback
+
+        if answer != fallback:
+            break
+
+    return answer, steps
+
+
+async def _arun(
+    agent_executor: AgentExecutor,
+    input: Dict[str, Any],
+    config: RunnableConfig,
+    check: Callable[[str], str],
+    fallback: str,
+    steps: Steps,
+) -> str:
+    checkpoint = list(steps)
+    try:
+        output = None
+        async for chunk in agent_executor.astream(
+            dict(input, checkpoint=checkpoint), config
+        ):
+            if "steps" in chunk:
+                steps += [(s.action, s.observation) for s in chunk["steps"]]
+            elif "output" in chunk:
+                output = chunk["output"]
+        return check(output)
+    except ResponseBlockedError:
+        return fallback
+
+
+async def arun_with_retries(
+    agent_executor: AgentExecutor,
+    input: Dict[str, Any],
+    config: RunnableConfig,
+    check: Callable[[str], str],
+    fallback: str,
+    tries: int = 2,
+    hedge_after: float = RETRY_HEDGE_AFTER,
+) -> Tuple[str, Steps]:
+    """Run an agent executor until `check` accepts its answer, asynchronously.
+
+    Like `run_with_retries`, but when `hedge_after` is set and an attempt takes
+    longer, the retry starts right away from the steps taken so far, and the
+    first accepted answer of both is returned.
+    """
+    attempts = {}
+    hedges = set()
+
+    def start(checkpoint: Steps) -> asyncio.Task:
+        steps = list(checkpoint)
+        task = asyncio.create_task(
+            _arun(agent_executor, input, config, check, fallback, steps)
+        )
+        attempts[task] = steps
+        return task
+
+    start([])
+    tries -= 1
+    answer, steps = fallback, []
+    try:
+        while attempts:
+            done, _ = await asyncio.wait(
+                attempts,
+                timeout=hedge_after if hedge_after > 0 and tries > 0 else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                checkpoint = list(next(iter(attempts.values())))
+                RETRY_STATS.count_retry(checkpoint, hedged=True)
+                hedges.add(start(checkpoint))
+                tries -= 1
+                continue
+
+            for task in done:
+                answer, steps = task.result(), attempts.pop(task)
+                if answer != fallback:
+                    if task in hedges:
+                        RETRY_STATS.count_hedge_won()
+                    return answer, steps
+
+            if not attempts and tries > 0:
+                RETRY_STATS.count_retry(steps)
+                start(steps)
+                tries -= 1
+
+        return answer, steps
+    finally:
+        for task in attempts:
+            task.cancel()
+
+
+async def astream_with_retries(
+    agent_executor: AgentExecutor,
+    input: Dict[str, Any],
+    config: RunnableConfig,
+    run_manager: AsyncCallbackManagerForChainRun,
+    check: Callable[[str], str],
+    fallback: str,
+    can_retry: Callable[[], bool] = lambda: True,
+    tries: int = 2,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """Stream the events of an agent executor until `check` accepts its answer.
+
+    Yields the events of `astream_agent` for every attempt, but their output,
+    then `("answer", answer)`, which is `fallback` when no answer was accepted.
+    Like `run_with_retries`, a retry resumes from the steps already streamed,
+    and only starts if `can_retry()`, e.g. while no part of the answer was sent.
+    """
+    steps = []
+    answer = fallback
+    for attempt in range(tries):
+        checkpoint = list(steps)
+        if attempt:
+            if not can_retry():
+                break
+            RETRY_STATS.count_retry(checkpoint)
+        answer = fallback
+        try:
+            async for kind, value in astream_agent(
+                agent_executor,
+                dict(input, checkpoint=checkpoint),
+                config,
+                run_manager.get_child(),
+            ):
+                if kind == "output":
+                    answer = check(value["output"])
+                    continue
+                if kind == "steps":
+                    steps += [(s.action, s.observation) for s in value]
+                yield kind, value
+        except ResponseBlockedError:
+            answer = fallback
+
+        if answer != fallback:
+            break
+
+    yield "answer", answer
@@ -0,0 +1,273 @@
+"""Session stores: Datastore, in memory, or SQLite."""
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from datetime import datetime
+from functools import lru_cache
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Optional
+
+from google.cloud import datastore
+
+
+PROJECT_ID = os.environ.get("_PROJECT_ID", "dgc-ml-gemini-autogen")
+DATASTORE_SESSION_ENTITY_NAME = os.environ.get(
+    "_DATASTORE_SESSION_ENTITY_NAME", "session"
+)
+DATASTORE_TURN_ENTITY_NAME = os.environ.get("_DATASTORE_TURN_ENTITY_NAME", "turn")
+SQLITE_PATH = os.environ.get("_SESSION_STORE_PATH", "sessions.db")
+# Datastore writes at most 500 entities in a commit
+DATASTORE_BATCH_SIZE = 500
+
+
+class SessionStore(ABC):
+    """Where the sessions and their turns are stored.
+
+    A session is a dict, and its turns are dicts with their `turn` number.
+    """
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[dict]:
+        """Get a session, without its turns."""
+
+    @abstractmethod
+    def get_turns(self, session_id: str, after: int = 0) -> List[dict]:
+        """Get the turns of a session after a turn number, in order."""
+
+    @abstractmethod
+    def put(self, session_id: str, turns: List[dict], value: dict):
+        """Put turns of a session, and replace the session."""
+
+
+@lru_cache(1)
+def get_datastore_client() -> datastore.Client:
+    """Get a Datastore client."""
+    return datastore.Client(project=PROJECT_ID)
+
+
+class DatastoreSessionStore(SessionStore):
+    """Store the sessions in Datastore.
+
+    Each turn is stored as a child entity of the session, keyed by its number,
+    so the turns after the summary are read with a single key range query.
+    """
+
+    def get_session(self, session_id: str) -> Optional[dict]:
+        """Get a session, without its turns."""
+        ds_client = get_datastore_client()
+        return ds_client.get(ds_client.key(DATASTORE_SESSION_ENTITY_NAME, session_id))
+
+    def get_turns(self, session_id: str, after: int = 0) -> List[dict]:
+        """Get the turns of a session after a turn number, in order."""
+        ds_client = get_datastore_client()
+        key = ds_client.key(DATASTORE_SESSION_ENTITY_NAME, session_id)
+        query = ds_client.query(kind=DATASTORE_TURN_ENTITY_NAME, ancestor=key)
+        if after:
+            query.add_filter(
+                "__key__",
+                ">",
+                ds_client.key(DATASTORE_TURN_ENTITY_NAME, after, parent=key),
+            )
+        query.order = ["__key__"]
+        return [dict(e, turn=e.key.id) for e in query.fetch()]
+
+    def put(self, session_id: str, turns: List[dict], value: dict):
+        """Put turns of a session, and replace the session."""
+        ds_client = get_datastore_client()
+        key = ds_client.key(
+            DATASTORE_SESSION_ENTITY_NAME,
+            session_id,
+        )
+        entities = []
+        for turn in turns:
+            entity = datastore.Entity(
+                ds_client.key(DATASTORE_TURN_ENTITY_NAME, turn["turn"], parent=key),
+                exclude_from_indexes=["question", "answer", "tools"],
+            )
+            entity.update({k: v for k, v in turn.items() if k != "turn"})
+            entities.append(entity)
+        # Replacing the session entity also drops the conversation of the
+        # legacy layout, whose turns are written as entities along. It is
+        # written last, so a migration failing between batches is run again.
+        session = datastore.Entity(key, exclude_from_indexes=["summary"])
+        session.update(value)
+        entities.append(session)
+        for i in range(0, len(entities), DATASTORE_BATCH_SIZE):
+            ds_client.put_multi(entities[i : i + DATASTORE_BATCH_SIZE])
+
+
+class MemorySessionStore(SessionStore):
+    """Store the sessions in memory, until the process stops."""
+
+    def __init__(self):
+        """Initialize the store."""
+        self.sessions = {}
+        self.turns = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, session_id: str) -> Optional[dict]:
+        """Get a session, without its turns."""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            return dict(session) if session is not None else None
+
+    def get_turns(self, session_id: str, after: int = 0) -> List[dict]:
+        """Get the turns of a session after a turn number, in order."""
+        with self._lock:
+            turns = self.turns.get(session_id, {})
+            return [dict(turns[n]) for n in sorted(turns) if n > after]
+
+    def put(self, session_id: str, turns: List[dict], value: dict):
+        """Put turns of a session, and replace the session."""
+        with self._lock:
+            self.sessions[session_id] = dict(value)
+            stored = self.turns.setdefault(session_id, {})
+            stored.update({t["turn"]: dict(t) for t in turns})
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store the sessions in a SQLite database, in WAL mode.
+
+    Reads use a connection per thread, and don't wait for the writes. The
+    writes are committed by a single thread: the ones queued while it commits
+    are committed together in the next transaction, and `put` returns once its
+    own is committed.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        """Initialize the store, and create its tables."""
+        self.path = path
+        self._local = threading.local()
+        self._queue = []
+        self._condition = threading.Condition()
+        self.transactions = 0
+        self.writes = 0
+
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS turns (
+                session_id TEXT NOT NULL,
+                turn INTEGER NOT NULL,
+                question TEXT,
+                answer TEXT,
+                tools BLOB,
+                tokens INTEGER,
+                PRIMARY KEY (session_id, turn)
+            ) WITHOUT ROWID;
+            """
+        )
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get_session(self, session_id: str) -> Optional[dict]:
+        """Get a session, without its turns."""
+        row = (
+            self._connect()
+            .execute("SELECT value FROM sessions WHERE session_id = ?", (session_id,))
+            .fetchone()
+        )
+        return json.loads(row[0]) if row is not None else None
+
+    def get_turns(self, session_id: str, after: int = 0) -> List[dict]:
+        """Get the turns of a session after a turn number, in order."""
+        rows = self._connect().execute(
+            "SELECT turn, question, answer, tools, tokens FROM turns "
+            "WHERE session_id = ? AND turn > ? ORDER BY turn",
+            (session_id, after),
+        )
+        return [
+            {
+                "turn": turn,
+                "question": question,
+                "answer": answer,
+                "tools": tools,
+                "tokens": tokens,
+            }
+            for turn, question, answer, tools, tokens in rows
+        ]
+
+    def put(self, session_id: str, turns: List[dict], value: dict):
+        """Put turns of a session, and replace the session."""
+        future = Future()
+        with self._condition:
+            self._queue.append((session_id, turns, value, future))
+            self._condition.notify()
+        future.result()
+
+    def _run(self):
+        connection = self._connect()
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue)
+                batch, self._queue = self._queue, []
+
+            try:
+                connection.execute("BEGIN")
+                for session_id, turns, value, _ in batch:
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO turns VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (
+                                session_id,
+                                t["turn"],
+                                t["question"],
+                                t["answer"],
+                                t["tools"],
+                                t.get("tokens"),
+                            )
+                            for t in turns
+                        ],
+                    )
+                    connection.execute(
+                        "INSERT OR REPLACE INTO sessions VALUES (?, ?)",
+                        (session_id, json.dumps(value, default=_to_json)),
+                    )
+                connection.execute("COMMIT")
+            except Exception as e:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                for *_, future in batch:
+                    future.set_exception(e)
+            else:
+                self.transactions += 1
+                self.writes += len(batch)
+                for *_, future in batch:
+                    future.set_result(None)
+
+
+def _to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+SESSION_STORES = {
+    "datastore": DatastoreSessionStore,
+    "memory": MemorySessionStore,
+    "sqlite": SQLiteSessionStore,
+}
+
+
+@lru_cache(1)
+def get_session_store() -> SessionStore:
+    """Get the session store set by `_SESSION_STORE`.
+
+    Defaults to `memory` when running locally, and to `datastore` otherwise.
+    """
+    default = "memory" if os.environ.get("_LOCAL") else "datastore"
+    return SESSION_STORES[os.environ.get("_SESSION_STORE", default)]()
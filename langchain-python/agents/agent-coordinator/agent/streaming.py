@@ -0,0 +1,247 @@
+"""Streaming utilities."""
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentAction, AgentStep
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.pydantic_v1 import BaseModel
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import patch_config
+from langchain_google_vertexai.chat_models import (
+    ChatVertexAI,
+    _format_tools_to_vertex_tool,
+    _parse_chat_history_gemini,
+    _parse_response_candidate,
+)
+
+
+# Tag of the model runs that may produce the answer of the agent
+ANSWER_TAG = "agent_answer"
+
+
+class StreamingChatVertexAI(ChatVertexAI):
+    """ChatVertexAI streaming its answers asynchronously.
+
+    langchain-google-vertexai 0.0.2 only streams synchronously, so `astream`
+    used to fall back to a single call, with no token before the whole answer
+    was generated.
+    """
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if not self._is_gemini_model:
+            result = await self._agenerate(messages, stop=stop, **kwargs)
+            message = result.generations[0].message
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content=message.content,
+                    additional_kwargs=message.additional_kwargs,
+                )
+            )
+            return
+
+        params = self._prepare_params(stop=stop, stream=True, **kwargs)
+        history_gemini = _parse_chat_history_gemini(
+            messages,
+            project=self.project,
+            convert_system_message_to_human=self.convert_system_message_to_human,
+        )
+        message = history_gemini.pop()
+        chat = self.client.start_chat(history=history_gemini)
+        raw_tools = params.pop("functions") if "functions" in params else None
+        tools = _format_tools_to_vertex_tool(raw_tools) if raw_tools else None
+        responses = await chat.send_message_async(
+            message, stream=True, generation_config=params, tools=tools
+        )
+        async for response in responses:
+            message = _parse_response_candidate(response.candidates[0])
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content=message.content,
+                    additional_kwargs=message.additional_kwargs,
+                )
+            )
+            if run_manager:
+                await run_manager.on_llm_new_token(message.content, chunk=chunk)
+            yield chunk
+
+
+class AnswerTokenHandler(AsyncCallbackHandler):
+    """Put the tokens of the model runs tagged with `ANSWER_TAG` in a queue."""
+
+    def __init__(self, queue: asyncio.Queue):
+        """Initialize the handler."""
+        self.queue = queue
+        self.run_ids = set()
+
+    async def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        tags: Optional[List[str]] = None,
+        **kwargs: Any,
+    ):
+        """Remember the runs that may produce the answer."""
+        if ANSWER_TAG in (tags or []):
+            self.run_ids.add(run_id)
+
+    async def on_llm_new_token(
+        self,
+        token: str,
+        *,
+        chunk: Optional[ChatGenerationChunk] = None,
+        run_id: UUID,
+        **kwargs: Any,
+    ):
+        """Queue a token of the answer, or the start of a function call."""
+        if run_id not in self.run_ids:
+            return
+        if chunk is not None and "function_call" in chunk.message.additional_kwargs:
+            await self.queue.put(("function_call", run_id))
+        elif token:
+            await self.queue.put(("token", (run_id, token)))
+
+
+async def aiter_input(input: Any) -> AsyncIterator[Any]:
+    """Get an async iterator over a single input."""
+    yield input
+
+
+def format_action(action: AgentAction) -> dict:
+    """Format a tool call of the agent for the stream."""
+    tool_input = action.tool_input
+    if isinstance(tool_input, BaseModel):
+        tool_input = tool_input.dict()
+    return {"tool": action.tool, "tool_input": tool_input}
+
+
+def format_step(step: AgentStep) -> dict:
+    """Format a tool result for the stream."""
+    return {"tool": step.action.tool, "observation": str(step.observation)}
+
+
+async def astream_agent(
+    agent_executor: AgentExecutor,
+    input: Dict[str, Any],
+    config: RunnableConfig,
+    callbacks: Any,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """Run an agent executor, yielding its events as soon as they happen.
+
+    Events are `("actions", [...])` and `("steps", [...])` for the tool calls
+    and their results, `("token", (run_id, token))` for the tokens of the
+    answer, `("function_call", run_id)` when a model run turns out to call a
+    tool, and `("output", output)` for the final output of the executor.
+    """
+    queue = asyncio.Queue()
+    callbacks.add_handler(AnswerTokenHandler(queue), inherit=True)
+    config = patch_config(config, callbacks=callbacks)
+
+    async def run():
+        try:
+            async for chunk in agent_executor.astream(input, config):
+                if "actions" in chunk:
+                    await queue.put(("actions", chunk["actions"]))
+                elif "steps" in chunk:
+                    await queue.put(("steps", chunk["steps"]))
+                elif "output" in chunk:
+                    await queue.put(("output", chunk))
+        except Exception as e:
+            await queue.put(("error", e))
+        finally:
+            await queue.put(("end", None))
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "end":
+                break
+            if kind == "error":
+                raise value
+            yield kind, value
+    finally:
+        task.cancel()
+
+
+class StreamingFilter:
+    """Release the text of an answer as soon as a filter accepts it.
+
+    `check` returns the message unchanged when it accepts it, like
+    `simple_responsible_ai_filter`. The text is held back until it is accepted,
+    and trailing backticks until the next token shows whether they open a code
+    block. As a code block is never accepted, nothing after it is released.
+    """
+
+    def __init__(self, check: Callable[[str], str]):
+        """Initialize the filter."""
+        self.check = check
+        self.text = ""
+        self.released = ""
+
+    def feed(self, token: str) -> str:
+        """Add a token, and get the text that can be released."""
+        self.text += token
+        text = self.text.strip()
+        if self.check(text) != text:
+            return ""
+
+        text = text.rstrip("`")
+        if not text.startswith(self.released):
+            return ""
+        new_text, self.released = text[len(self.released) :], text
+        return new_text
+
+
+class AnswerStream:
+    """Turn the tokens of the model runs of an agent into the text of its answer.
+
+    Every model run gets its own filter. The text of a run calling a tool is
+    dropped, unless some of it has already been released.
+    """
+
+    def __init__(self, check: Callable[[str], str]):
+        """Initialize the stream."""
+        self.check = check
+        self.released = ""
+        self._run_id = None
+        self._filter = None
+
+    def on_token(self, run_id: UUID, token: str) -> str:
+        """Add a token, and get the text that can be released."""
+        if run_id != self._run_id:
+            self._run_id = run_id
+            self._filter = StreamingFilter(self.check)
+        if self._filter is None:
+            return ""
+
+        text = self._filter.feed(token)
+        if text and self.released and self._filter.released == text:
+            text = "\n\n" + text
+        self.released += text
+        return text
+
+    def on_function_call(self, run_id: UUID):
+        """Drop the text of a run calling a tool."""
+        if run_id == self._run_id and not (self._filter and self._filter.released):
+            self._filter = None
+
+    def on_answer(self, answer: str) -> str:
+        """Get the rest of the final answer, already checked, to release."""
+        released = self._filter.released if self._filter else ""
+        text = answer[len(released) :] if answer.startswith(released) else ""
+        if text and self.released and not released:
+            text = "\n\n" + text
+        self.released += text
+        return text
@@ -1,10 +1,14 @@
 """General utilities for tools."""
 from langchain_core.tools import Tool
 
-from agent.tools.knowledge_base import knowledge_base_tool, KnowledgeBaseInput
+from agent.tools.knowledge_base import (
+    aknowledge_base_tool,
+    knowledge_base_tool,
+    KnowledgeBaseInput,
+)
 
 
-def get_all_tools(authorization_token: str):
+def get_all_tools():
     """Get all tools."""
     return [
         Tool(
@@ -14,7 +18,8 @@ def get_all_tools(authorization_token: str):
                 "Input is the question that must be provided by the user. "
                 "Output is the information found in the knowledge base."
             ),
-            func=knowledge_base_tool(authorization_token),
+            func=knowledge_base_tool,
+            coroutine=aknowledge_base_tool,
             args_schema=KnowledgeBaseInput,
         ),
     ]
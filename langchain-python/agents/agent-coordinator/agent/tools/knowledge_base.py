@@ -1,10 +1,11 @@
 """Knowledge base tool."""
 import os
 
-import google.auth.transport.requests
-import google.oauth2.id_token
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langserve import RemoteRunnable
+
+from agent.auth import AUTHORIZATION_TOKEN, ID_TOKENS
+from agent.cache import AnswerCache
+from agent.remote import get_agent_runnable
 
 
 class KnowledgeBaseInput(BaseModel):
@@ -15,34 +16,56 @@ class KnowledgeBaseInput(BaseModel):
     )
 
 
-def knowledge_base_tool(authorization_token: str):
-    """Knowledge base tool."""
+AGENT_KNOWLEDGE_BASE_URL = os.environ.get("_AGENT_KNOWLEDGE_BASE_URL")
+
+
+def get_authorization() -> str:
+    """Get the authorization header of a request to the knowledge base."""
+    if AGENT_KNOWLEDGE_BASE_URL:
+        return f"Bearer {ID_TOKENS.get(AGENT_KNOWLEDGE_BASE_URL)}"
+
+    return AUTHORIZATION_TOKEN.get()
+
+
+def is_answer(response: dict) -> bool:
+    """Check that the knowledge base answered, to only cache actual answers."""
+    return not response.get("fallback", False)
+
+
+KNOWLEDGE_BASE_CACHE = AnswerCache(accept=is_answer)
+
 
-    def _wrapper(query: str):
-        cloud_run_id_token = None
-        agent_knowledge_base_url = os.environ.get("_AGENT_KNOWLEDGE_BASE_URL")
-        if agent_knowledge_base_url:
-            auth_req = google.auth.transport.requests.Request()
-            cloud_run_id_token = google.oauth2.id_token.fetch_id_token(
-                auth_req,
-                agent_knowledge_base_url,
-            )
-
-        chat = RemoteRunnable(
-            agent_knowledge_base_url or "http://localhost:8081/",
-            headers={
-                "Authorization": (
-                    f"Bearer {cloud_run_id_token}"
-                    if cloud_run_id_token
-                    else authorization_token
-                ),
+def knowledge_base_tool(query: str):
+    """Knowledge base tool."""
+    chat = get_agent_runnable(
+        "knowledge-base",
+        AGENT_KNOWLEDGE_BASE_URL or "http://localhost:8081/",
+        get_authorization,
+    )
+    return KNOWLEDGE_BASE_CACHE.get(
+        query,
+        lambda: chat.invoke(
+            {
+                "message": f"{query}",
             },
-        )
-        answer = chat.invoke(
+        ),
+    )["output"]
+
+
+async def aknowledge_base_tool(query: str):
+    """Knowledge base tool, asynchronously."""
+    chat = get_agent_runnable(
+        "knowledge-base",
+        AGENT_KNOWLEDGE_BASE_URL or "http://localhost:8081/",
+        get_authorization,
+    )
+
+    async def fetch() -> dict:
+        return await chat.ainvoke(
             {
                 "message": f"{query}",
             },
-        )["output"]
-        return answer
+        )
 
-    return _wrapper
+    response = await KNOWLEDGE_BASE_CACHE.aget(query, fetch)
+    return response["output"]
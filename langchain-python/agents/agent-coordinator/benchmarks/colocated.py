@@ -0,0 +1,196 @@
+"""Measure the latency of a question, with the agents deployed apart and together.
+
+Apart, the coordinator and the knowledge base are two apps: a question goes
+from the coordinator to the knowledge base, and back to the coordinator to
+rewrite the answer, over HTTP, with ID tokens from a stand-in for the metadata
+server. Together, both agents are served by the app of `agent-colocated`, and
+call each other in process. Each app is served by uvicorn in a thread of this
+process, and the models are fake chat models calling the tool of their agent
+once before answering. Run from the `agent-coordinator` folder:
+
+    python -m benchmarks.colocated [--questions 100] [--latency 0.05]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+import statistics
+import sys
+import threading
+import time
+from typing import List
+
+COORDINATOR_PORT = 8090
+KNOWLEDGE_BASE_PORT = 8091
+COLOCATED_PORT = 8092
+
+os.environ.setdefault("_LOCAL", "1")
+os.environ["_AGENT_COORDINATOR_URL"] = f"http://localhost:{COORDINATOR_PORT}/"
+os.environ["_AGENT_KNOWLEDGE_BASE_URL"] = f"http://localhost:{KNOWLEDGE_BASE_PORT}/"
+sys.path.append(str(Path(__file__).resolve().parents[2] / "agent-colocated"))
+
+from fastapi import FastAPI  # noqa: E402
+import httpx  # noqa: E402
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage  # noqa: E402
+from langserve import add_routes  # noqa: E402
+import uvicorn  # noqa: E402
+
+from benchmarks.fake_llm import FakeChatModel  # noqa: E402
+from benchmarks.metadata_server import make_token  # noqa: E402
+from colocated import create_app, per_req_config_modifier  # noqa: E402
+from coordinator_agent import auth as coordinator_auth  # noqa: E402
+from coordinator_agent import coordinator  # noqa: E402
+from coordinator_agent import remote as coordinator_remote  # noqa: E402
+from coordinator_agent.tools.knowledge_base import KNOWLEDGE_BASE_CACHE  # noqa: E402
+from knowledge_base_agent import auth as knowledge_base_auth  # noqa: E402
+from knowledge_base_agent import knowledge_base  # noqa: E402
+from knowledge_base_agent import remote as knowledge_base_remote  # noqa: E402
+
+
+class ToolCallingChatModel(FakeChatModel):
+    """Fake chat model calling a tool with the question, then answering."""
+
+    tool: str
+    argument: str
+
+    def respond(self, messages: List[BaseMessage]) -> AIMessage:
+        """Call the tool for a question, and answer the rewrite requests."""
+        message = messages[-1]
+        if isinstance(message, HumanMessage) and not message.content.startswith(
+            "Please rewrite"
+        ):
+            arguments = json.dumps({self.argument: message.content})
+            return AIMessage(
+                content="",
+                additional_kwargs={
+                    "function_call": {"name": self.tool, "arguments": arguments}
+                },
+            )
+        return super().respond(messages)
+
+
+def get_agents(latency: float):
+    """Get a coordinator and a knowledge base, with fake chat models."""
+    return (
+        coordinator.CustomAgentExecutor(
+            llm=ToolCallingChatModel(
+                tool="knowledge_base_tool", argument="query", latency=latency
+            )
+        ),
+        knowledge_base.CustomAgentExecutor(
+            llm=ToolCallingChatModel(
+                tool="rewrite_answer_tool", argument="answer", latency=latency
+            )
+        ),
+    )
+
+
+def get_app(agent) -> FastAPI:
+    """Get the app of a single agent, as its own `main.py` serves it."""
+    app = FastAPI()
+    add_routes(
+        app,
+        agent,
+        per_req_config_modifier=per_req_config_modifier,
+        enabled_endpoints=["invoke"],
+    )
+    return app
+
+
+def serve(app: FastAPI, port: int):
+    """Serve an app in a thread."""
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+
+def ask(port: int, mode: str, questions: int, warmup: int) -> List[float]:
+    """Ask questions to the coordinator one after the other."""
+    latencies = []
+    with httpx.Client(
+        base_url=f"http://localhost:{port}",
+        headers={"Authorization": "Bearer fake"},
+        timeout=60,
+    ) as client:
+        for i in range(warmup + questions):
+            input = {"message": "What is Google Cloud?", "session_id": f"{mode}-{i}"}
+            start = time.perf_counter()
+            response = client.post("/invoke", json={"input": input})
+            response.raise_for_status()
+            if i >= warmup:
+                latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def summarize(mode: str, latencies: List[float], calls: dict) -> dict:
+    """Summarize the latencies of a mode, and the calls between the agents."""
+    return {
+        "mode": mode,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+        "calls_between_agents": {
+            url: stats["requests"] for url, stats in calls.items()
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="model latency in seconds"
+    )
+    args = parser.parse_args()
+
+    # Every question goes through both agents
+    KNOWLEDGE_BASE_CACHE.max_size = 0
+    for auth in (coordinator_auth, knowledge_base_auth):
+        auth.ID_TOKENS.fetch = lambda audience: make_token(audience, 3600)
+
+    results = []
+    # The executors are verbose, keep them quiet
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Apart first, as mounting the agents together makes them call each
+        # other in process
+        coordinator_agent, knowledge_base_agent = get_agents(args.latency)
+        serve(get_app(coordinator_agent), COORDINATOR_PORT)
+        serve(get_app(knowledge_base_agent), KNOWLEDGE_BASE_PORT)
+        latencies = ask(COORDINATOR_PORT, "apart", args.questions, args.warmup)
+        results.append(
+            summarize(
+                "apart",
+                latencies,
+                {
+                    **coordinator_remote.get_connection_stats(),
+                    **knowledge_base_remote.get_connection_stats(),
+                },
+            )
+        )
+
+        serve(create_app(*get_agents(args.latency)), COLOCATED_PORT)
+        latencies = ask(COLOCATED_PORT, "together", args.questions, args.warmup)
+        results.append(
+            summarize(
+                "together",
+                latencies,
+                {
+                    url: stats
+                    for stats in (
+                        coordinator_remote.get_connection_stats(),
+                        knowledge_base_remote.get_connection_stats(),
+                    )
+                    for url, stats in stats.items()
+                    if url.startswith("local:")
+                },
+            )
+        )
+
+    for result in results:
+        print(", ".join(f"{key}: {value}" for key, value in result.items()))
@@ -0,0 +1,69 @@
+"""Load test the coordinator on one event loop, with the sync and async paths.
+
+Starts many conversations at once from a single event loop, as one uvicorn
+worker would. The sync path runs `invoke` in the default thread pool, which is
+what langserve did before the executor implemented `ainvoke`; the async path
+awaits `ainvoke`. The model is a fake chat model with a fixed latency, and the
+history is kept in memory (`_LOCAL`). Run from the `agent-coordinator` folder:
+
+    python -m benchmarks.concurrency [--conversations 200] [--latency 1.0]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+
+os.environ.setdefault("_LOCAL", "1")
+
+from langchain_core.runnables import Runnable  # noqa: E402
+
+from agent.coordinator import CustomAgentExecutor  # noqa: E402
+from benchmarks.fake_llm import FakeChatModel  # noqa: E402
+
+
+async def run(path: str, conversations: int, latency: float) -> dict:
+    """Run concurrent conversations through one path."""
+    llm = FakeChatModel(latency=latency)
+    executor = CustomAgentExecutor(llm=llm)
+
+    async def conversation(i: int) -> float:
+        input = {"message": "What is Google Cloud?", "session_id": f"{path}-{i}"}
+        config = {"configurable": {"authorization_token": "Bearer fake"}}
+        start = time.perf_counter()
+        if path == "sync":
+            await Runnable.ainvoke(executor, input, config)
+        else:
+            await executor.ainvoke(input, config)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = sorted(
+        await asyncio.gather(*(conversation(i) for i in range(conversations)))
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        "path": path,
+        "conversations_per_second": round(conversations / elapsed, 1),
+        "peak_concurrency": llm.peak_in_flight,
+        "p50_seconds": round(latencies[len(latencies) // 2], 2),
+        "max_seconds": round(latencies[-1], 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=1.0, help="model latency in seconds"
+    )
+    args = parser.parse_args()
+
+    for path in ("sync", "async"):
+        # The executor and the local history are verbose, keep them quiet
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = asyncio.run(run(path, args.conversations, args.latency))
+        print(", ".join(f"{key}: {value}" for key, value in result.items()))
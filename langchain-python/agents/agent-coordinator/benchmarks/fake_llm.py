@@ -0,0 +1,110 @@
+"""Fake chat model for the offline benchmarks."""
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model answering with the same message after a fixed latency.
+
+    Sync calls sleep and async calls await, like a client waiting on the API
+    would. When streamed, the first word comes after `latency` and every next
+    one after `token_latency`. The number of calls in flight, and its peak, are
+    tracked to measure how many conversations a process actually serves at once.
+    Subclasses override `respond` to answer differently, e.g. with a tool call.
+    """
+
+    answer: str = "Google Cloud is a suite of cloud computing services."
+    latency: float = 0.0
+    token_latency: float = 0.0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    _lock: Any = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def get_num_tokens(self, text: str) -> int:
+        """Count the words of a text, instead of loading a tokenizer."""
+        return len(text.split())
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def respond(self, messages: List[BaseMessage]) -> AIMessage:
+        """Get the message answering the messages, the same answer by default."""
+        return AIMessage(content=self.answer)
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self.respond(messages))])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self._enter()
+        try:
+            time.sleep(self.latency)
+        finally:
+            self._exit()
+        return self._result(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self._enter()
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self._exit()
+        return self._result(messages)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        self._enter()
+        try:
+            await asyncio.sleep(self.latency)
+            message = self.respond(messages)
+            if message.additional_kwargs:
+                yield ChatGenerationChunk(
+                    message=AIMessageChunk(
+                        content=message.content,
+                        additional_kwargs=message.additional_kwargs,
+                    )
+                )
+                return
+
+            for i, word in enumerate(message.content.split(" ")):
+                if i:
+                    await asyncio.sleep(self.token_latency)
+                token = f" {word}" if i else word
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+                if run_manager:
+                    await run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
+        finally:
+            self._exit()
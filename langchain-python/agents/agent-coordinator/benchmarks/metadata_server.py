@@ -0,0 +1,87 @@
+"""Local stand-in for the metadata server, issuing short-lived ID tokens.
+
+The tokens are unsigned JWTs, only meant to exercise the ID token cache of the
+agents. Start it, then point the agents and `google-auth` at it:
+
+    python -m benchmarks.metadata_server [--port 8089] [--lifetime 120]
+    GCE_METADATA_HOST=localhost:8089 GCE_METADATA_IP=localhost:8089 \\
+        _AGENT_KNOWLEDGE_BASE_URL=http://localhost:8081/ python main.py
+"""
+import argparse
+import base64
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+SERVICE_ACCOUNT_PATH = "/computeMetadata/v1/instance/service-accounts/default/"
+IDENTITY_PATH = SERVICE_ACCOUNT_PATH + "identity"
+SERVICE_ACCOUNT = {
+    "aliases": ["default"],
+    "email": "agent@localhost",
+    "scopes": ["https://www.googleapis.com/auth/cloud-platform"],
+}
+
+
+def encode(value: dict) -> str:
+    """Encode a JWT segment."""
+    data = json.dumps(value).encode("utf-8")
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def make_token(audience: str, lifetime: float) -> str:
+    """Make an unsigned ID token for an audience."""
+    now = int(time.time())
+    claims = {"aud": audience, "iat": now, "exp": now + int(lifetime)}
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode(claims)}."
+
+
+class MetadataHandler(BaseHTTPRequestHandler):
+    """Answer the metadata server ping and the identity requests."""
+
+    lifetime = 120.0
+    delay = 0.0
+
+    def _send(self, status: int, body: str = "", content_type="application/text"):
+        self.send_response(status)
+        self.send_header("Metadata-Flavor", "Google")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def do_GET(self):
+        """Answer a GET request."""
+        if self.headers.get("Metadata-Flavor") != "Google":
+            return self._send(403)
+
+        url = urlparse(self.path)
+        if url.path in ("", "/"):
+            return self._send(200)
+        if url.path == SERVICE_ACCOUNT_PATH:
+            return self._send(200, json.dumps(SERVICE_ACCOUNT), "application/json")
+        if url.path != IDENTITY_PATH:
+            return self._send(404)
+
+        audience = parse_qs(url.query).get("audience", [""])[0]
+        time.sleep(self.delay)
+        self._send(200, make_token(audience, self.lifetime))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument(
+        "--lifetime", type=float, default=120, help="token lifetime in seconds"
+    )
+    parser.add_argument(
+        "--delay", type=float, default=0, help="latency of a token request in seconds"
+    )
+    args = parser.parse_args()
+
+    MetadataHandler.lifetime = args.lifetime
+    MetadataHandler.delay = args.delay
+    ThreadingHTTPServer(("localhost", args.port), MetadataHandler).serve_forever()
@@ -0,0 +1,110 @@
+"""Measure the per-request overhead of the agent coordinator.
+
+Compares rebuilding the model, prompt, tools, agent, output parser and executor
+on every request (as `CustomAgentExecutor.invoke` used to) with the executor
+prebuilt at startup. The model is a fake chat model answering instantly and the
+session id skips the history, so only the overhead of LangChain itself is
+measured. Building a `ChatVertexAI` client per request, which needs
+credentials, is left out, as is the conversation memory the old path built: both
+only widen the gap. Run from the `agent-coordinator` folder:
+
+    python -m benchmarks.per_request_overhead [--requests 500]
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import time
+
+os.environ.setdefault("_LOCAL", "1")
+
+from langchain.agents import AgentExecutor  # noqa: E402
+from langchain.agents.format_scratchpad import (  # noqa: E402
+    format_to_openai_function_messages,
+)
+from langchain_community.chat_models.fake import FakeListChatModel  # noqa: E402
+from unidecode import unidecode  # noqa: E402
+
+from agent.coordinator import (  # noqa: E402
+    FALLBACK_MESSAGE,
+    CustomAgentExecutor,
+    get_chat_prompt,
+)
+from agent.output_parser import CustomOutputParser  # noqa: E402
+from agent.tools.general import get_all_tools  # noqa: E402
+
+
+INPUT = {"message": "What is Google Cloud?", "session_id": "knowledge-base"}
+
+
+def get_fake_llm():
+    """Get a chat model answering instantly without calling any tool."""
+    return FakeListChatModel(responses=["Google Cloud is a cloud platform."])
+
+
+class PerRequestAgentExecutor(CustomAgentExecutor):
+    """The coordinator building its executor on every request, as it used to."""
+
+    def _invoke(self, input, config):
+        self.llm = get_fake_llm()
+        tools = get_all_tools()
+        agent = (
+            {
+                "message": lambda x: unidecode(x["message"]),
+                "chat_history": lambda x: x["chat_history"],
+                "agent_scratchpad": lambda x: format_to_openai_function_messages(
+                    x.get("checkpoint", []) + x["intermediate_steps"]
+                ),
+            }
+            | get_chat_prompt()
+            | self.llm.bind(functions=tools)
+            | CustomOutputParser(
+                pydantic_schema={tool.name: tool.args_schema for tool in tools},
+            )
+        )
+        self.agent_executor = AgentExecutor(
+            agent=agent,
+            tools=tools,
+            verbose=True,
+            max_iterations=15,
+            handle_parsing_errors=FALLBACK_MESSAGE,
+            return_intermediate_steps=True,
+        )
+        return super()._invoke(input, config)
+
+
+def per_request(requests):
+    """Build a new model, prompt, agent and executor for every request."""
+    executor = PerRequestAgentExecutor(llm=get_fake_llm())
+    for _ in range(requests):
+        start = time.perf_counter()
+        executor.invoke(INPUT, {"configurable": {"authorization_token": "Bearer fake"}})
+        yield time.perf_counter() - start
+
+
+def prebuilt(requests):
+    """Reuse a single executor for every request."""
+    executor = CustomAgentExecutor(llm=get_fake_llm())
+    for _ in range(requests):
+        start = time.perf_counter()
+        executor.invoke(INPUT, {"configurable": {"authorization_token": "Bearer fake"}})
+        yield time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    for name, run in (("per request", per_request), ("prebuilt", prebuilt)):
+        # The executor is verbose, keep its logs out of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies = sorted(run(args.requests))
+        print(
+            f"{name:<12} mean {statistics.mean(latencies) * 1000:.3f} ms, "
+            f"p50 {latencies[len(latencies) // 2] * 1000:.3f} ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.3f} ms"
+        )
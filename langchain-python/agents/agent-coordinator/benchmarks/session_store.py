@@ -0,0 +1,110 @@
+"""Measure the throughput of the session stores.
+
+Every thread runs turns on its own sessions, one after the other: a turn reads
+the session and its last turns, then writes a new turn and the session, like
+the coordinator does. The SQLite database is created in a temporary folder.
+Datastore is only measured when asked for, as it needs a project or the
+emulator (`DATASTORE_EMULATOR_HOST`). Run from the `agent-coordinator` folder:
+
+    python -m benchmarks.session_store [--threads 8] [--stores memory sqlite]
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import tempfile
+import time
+
+from langchain_core.messages import AIMessageChunk, FunctionMessage
+
+from agent.encoding import encode_tools
+from agent.store import SESSION_STORES, SessionStore, SQLiteSessionStore
+
+
+TOOLS = encode_tools(
+    [
+        AIMessageChunk(
+            content="",
+            additional_kwargs={
+                "function_call": {
+                    "name": "knowledge_base",
+                    "arguments": '{"query": "How do I get a laptop?"}',
+                }
+            },
+        ),
+        FunctionMessage(
+            name="knowledge_base",
+            content="Ask your manager, then open a ticket to the support. " * 20,
+        ),
+    ]
+)
+
+
+def run_turns(store: SessionStore, session_id: str, turns: int):
+    """Run the turns of a session."""
+    for number in range(1, turns + 1):
+        session = store.get_session(session_id) or {"summarized_turns": 0}
+        store.get_turns(session_id, max(0, number - 10))
+        store.put(
+            session_id,
+            [
+                {
+                    "turn": number,
+                    "question": "How do I get a new laptop?",
+                    "answer": "Ask your manager, then open a ticket to the support.",
+                    "tools": TOOLS,
+                    "tokens": 200,
+                }
+            ],
+            {
+                "summary": "",
+                "summarized_turns": session["summarized_turns"],
+                "turn_count": number,
+                "version": number,
+                "last_message_utc": datetime.utcnow(),
+            },
+        )
+
+
+def measure(store: SessionStore, threads: int, sessions: int, turns: int) -> dict:
+    """Measure the turns per second of a store."""
+    prefix = f"benchmark-{time.time_ns()}"
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(
+            pool.map(
+                lambda i: run_turns(store, f"{prefix}-{i}", turns), range(sessions)
+            )
+        )
+    elapsed = time.perf_counter() - start
+    result = {"turns_per_second": round(sessions * turns / elapsed)}
+    if isinstance(store, SQLiteSessionStore):
+        result["writes_per_transaction"] = round(
+            store.writes / store.transactions, 1
+        )
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument(
+        "--stores",
+        nargs="+",
+        choices=list(SESSION_STORES),
+        default=["memory", "sqlite"],
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for name in args.stores:
+            if name == "sqlite":
+                store = SQLiteSessionStore(os.path.join(folder, "sessions.db"))
+            else:
+                store = SESSION_STORES[name]()
+            result = measure(store, args.threads, args.sessions, args.turns)
+            print(f"{name}: " + ", ".join(f"{k}: {v}" for k, v in result.items()))
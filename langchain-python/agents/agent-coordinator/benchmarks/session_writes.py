@@ -0,0 +1,102 @@
+"""Measure the latency of the coordinator turns, with and without write-behind.
+
+Runs conversations of several turns at once, each turn waiting for the
+previous one, like a user would. The model is a fake chat model, the history is
+kept in memory (`_LOCAL`), and every session write waits for a latency drawn
+from an exponential distribution of mean `--write-latency`, as a Datastore
+write would. Run from the `agent-coordinator` folder:
+
+    python -m benchmarks.session_writes [--conversations 20] [--turns 10]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("_LOCAL", "1")
+
+from agent import history  # noqa: E402
+from agent.coordinator import CustomAgentExecutor  # noqa: E402
+from agent.store import get_session_store  # noqa: E402
+from benchmarks.fake_llm import FakeChatModel  # noqa: E402
+
+
+def with_latency(put, write_latency: float):
+    """Make the writes of a session store wait like a Datastore write would."""
+
+    def put_with_latency(*args, **kwargs):
+        time.sleep(random.expovariate(1 / write_latency))
+        return put(*args, **kwargs)
+
+    return put_with_latency
+
+
+async def run(
+    write_behind: bool, conversations: int, turns: int, latency: float
+) -> dict:
+    """Run the conversations, with or without write-behind."""
+    history.SESSION_WRITE_BEHIND = write_behind
+    executor = CustomAgentExecutor(llm=FakeChatModel(latency=latency))
+    prefix = "write-behind" if write_behind else "write-through"
+
+    async def conversation(i: int) -> list:
+        latencies = []
+        for turn in range(turns):
+            input = {"message": f"Question {turn}", "session_id": f"{prefix}-{i}"}
+            config = {"configurable": {"authorization_token": "Bearer fake"}}
+            start = time.perf_counter()
+            await executor.ainvoke(input, config)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    latencies = sorted(
+        latency
+        for result in await asyncio.gather(
+            *(conversation(i) for i in range(conversations))
+        )
+        for latency in result
+    )
+    history.SESSION_WRITER.flush()
+    stored = [
+        len(get_session_store().get_turns(f"{prefix}-{i}"))
+        for i in range(conversations)
+    ]
+    return {
+        "mode": prefix,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+        "stored_turns": f"{sum(stored)}/{conversations * turns}",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument(
+        "--latency", type=float, default=0.2, help="model latency in seconds"
+    )
+    parser.add_argument(
+        "--write-latency",
+        type=float,
+        default=0.05,
+        help="mean latency of a session write in seconds",
+    )
+    args = parser.parse_args()
+
+    store = get_session_store()
+    store.put = with_latency(store.put, args.write_latency)
+    for write_behind in (False, True):
+        # The executor and the local history are verbose, keep them quiet
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = asyncio.run(
+                run(write_behind, args.conversations, args.turns, args.latency)
+            )
+        print(", ".join(f"{key}: {value}" for key, value in result.items()))
+    print(history.SESSION_WRITER.stats())
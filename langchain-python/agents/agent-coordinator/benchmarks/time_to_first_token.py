@@ -0,0 +1,82 @@
+"""Measure the time to first token of the coordinator, with and without streaming.
+
+Without streaming, the first token comes with the whole answer. The model is a
+fake chat model waiting `--latency` seconds before its first word and
+`--token-latency` seconds before every next one. Run from the
+`agent-coordinator` folder:
+
+    python -m benchmarks.time_to_first_token [--requests 20]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import time
+
+os.environ.setdefault("_LOCAL", "1")
+
+from agent.coordinator import CustomAgentExecutor  # noqa: E402
+from benchmarks.fake_llm import FakeChatModel  # noqa: E402
+
+
+ANSWER = (
+    "Google Cloud is a suite of cloud computing services that runs on the same "
+    "infrastructure that Google uses internally for its end-user products."
+)
+
+
+async def first_token(executor: CustomAgentExecutor, stream: bool) -> tuple:
+    """Get the time to first token and to the full answer of one request."""
+    input = {"message": "What is Google Cloud?", "session_id": "knowledge-base"}
+    config = {"configurable": {"authorization_token": "Bearer fake"}}
+    start = time.perf_counter()
+    if not stream:
+        await executor.ainvoke(input, config)
+        elapsed = time.perf_counter() - start
+        return elapsed, elapsed
+
+    first = None
+    async for chunk in executor.astream(input, config):
+        if first is None and chunk.get("output"):
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+async def run(requests: int, latency: float, token_latency: float) -> list:
+    """Measure both paths."""
+    executor = CustomAgentExecutor(
+        llm=FakeChatModel(answer=ANSWER, latency=latency, token_latency=token_latency)
+    )
+    results = []
+    for stream in (False, True):
+        timings = [await first_token(executor, stream) for _ in range(requests)]
+        results.append(
+            {
+                "path": "astream" if stream else "ainvoke",
+                "first_token_ms": round(
+                    statistics.median(t[0] for t in timings) * 1000, 1
+                ),
+                "full_answer_ms": round(
+                    statistics.median(t[1] for t in timings) * 1000, 1
+                ),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.03)
+    args = parser.parse_args()
+
+    # The executor is verbose, keep its logs out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = asyncio.run(run(args.requests, args.latency, args.token_latency))
+    for result in results:
+        print(", ".join(f"{key}: {value}" for key, value in result.items()))
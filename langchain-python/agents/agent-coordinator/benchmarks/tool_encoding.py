@@ -0,0 +1,117 @@
+"""Measure the size and decoding time of the tool calls stored with the turns.
+
+Compares the dicts of the messages, stored before as JSON, with the compact
+encoding of `agent/encoding.py`, for a long session. Every turn calls the
+knowledge base once, and gets an answer of `--answer-words` random words. Run
+from the `agent-coordinator` folder:
+
+    python -m benchmarks.tool_encoding [--turns 50] [--answer-words 300]
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from langchain_core.messages import AIMessageChunk, FunctionMessage
+
+from agent.encoding import decode_tools, encode_tools
+
+
+WORDS = [
+    "cloud",
+    "project",
+    "billing",
+    "account",
+    "access",
+    "request",
+    "employee",
+    "laptop",
+    "policy",
+    "holiday",
+    "expense",
+    "manager",
+    "approval",
+    "ticket",
+    "support",
+    "network",
+    "office",
+    "training",
+    "certification",
+    "contract",
+]
+
+
+def make_tools(rng: random.Random, answer_words: int) -> list:
+    """Make the tool calls of a turn."""
+    query = " ".join(rng.choices(WORDS, k=8))
+    answer = " ".join(
+        f"{rng.choice(WORDS)}{rng.randrange(1000)}" for _ in range(answer_words)
+    )
+    return [
+        AIMessageChunk(
+            content="",
+            additional_kwargs={
+                "function_call": {
+                    "name": "knowledge_base",
+                    "arguments": json.dumps({"query": query}),
+                }
+            },
+        ),
+        FunctionMessage(name="knowledge_base", content=answer),
+    ]
+
+
+def decode_json(value: str) -> list:
+    """Decode the tool calls stored before, from JSON."""
+    messages = []
+    for msg in json.loads(value):
+        if msg["type"] == "AIMessageChunk":
+            messages.append(AIMessageChunk(**msg))
+        elif msg["type"] == "function":
+            messages.append(FunctionMessage(**msg))
+    return messages
+
+
+def measure(turns: list, encode, decode, repeat: int) -> dict:
+    """Measure the bytes per turn and the time to decode the whole session."""
+    encoded = [encode(tools) for tools in turns]
+    assert [decode(value) for value in encoded] == turns
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for value in encoded:
+            decode(value)
+        timings.append(time.perf_counter() - start)
+    sizes = [
+        len(value if isinstance(value, bytes) else value.encode("utf-8"))
+        for value in encoded
+    ]
+    return {
+        "bytes_per_turn": round(statistics.mean(sizes)),
+        "decode_session_ms": round(statistics.median(timings) * 1000, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--answer-words", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    turns = [make_tools(rng, args.answer_words) for _ in range(args.turns)]
+    results = {
+        "json": measure(
+            turns,
+            lambda tools: json.dumps([m.dict() for m in tools]),
+            decode_json,
+            args.repeat,
+        ),
+        "encoded": measure(turns, encode_tools, decode_tools, args.repeat),
+    }
+    for name, result in results.items():
+        print(f"{name}: " + ", ".join(f"{k}: {v}" for k, v in result.items()))
@@ -5,7 +5,12 @@ from typing import Dict
 from fastapi import FastAPI, HTTPException, Request
 from langserve import add_routes
 
+from agent.auth import ID_TOKENS
 from agent.coordinator import get_agent_coordinator
+from agent.history import SESSION_CACHE, SESSION_WRITER
+from agent.remote import get_connection_stats
+from agent.retries import RETRY_STATS
+from agent.tools.knowledge_base import KNOWLEDGE_BASE_CACHE
 
 
 PORT = int(os.getenv("AIP_HTTP_PORT", "8080"))
@@ -34,10 +39,29 @@ add_routes(
     app,
     get_agent_coordinator(),
     per_req_config_modifier=per_req_config_modifier,
-    enabled_endpoints=["invoke"],
+    enabled_endpoints=["invoke", "stream", "stream_events"],
 )
 
 
+@app.get("/stats")
+def stats() -> Dict:
+    """Get the stats of the calls to the other agents, retries and sessions."""
+    return {
+        "connections": get_connection_stats(),
+        "id_tokens": ID_TOKENS.stats(),
+        "retries": RETRY_STATS.to_dict(),
+        "knowledge_base_cache": KNOWLEDGE_BASE_CACHE.stats(),
+        "sessions": SESSION_CACHE.stats(),
+        "session_writes": SESSION_WRITER.stats(),
+    }
+
+
+@app.on_event("shutdown")
+def flush_sessions():
+    """Write the sessions still queued before the instance stops."""
+    SESSION_WRITER.flush()
+
+
 if __name__ == "__main__":
     import uvicorn
 
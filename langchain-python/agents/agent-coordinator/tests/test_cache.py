@@ -0,0 +1,103 @@
+"""Tests of the cache of the answers of the knowledge base."""
+import asyncio
+
+import pytest
+
+from agent.cache import AnswerCache
+from agent.tools.knowledge_base import is_answer
+
+
+async def start_lookups(cache: AnswerCache, fetch, count: int) -> list:
+    """Start concurrent lookups of the same query, the first one calling `fetch`."""
+    tasks = []
+    for _ in range(count):
+        tasks.append(asyncio.create_task(cache.aget("What is Google Cloud?", fetch)))
+        await asyncio.sleep(0)
+    return tasks
+
+
+def test_cancelled_follower_leaves_the_shared_call():
+    """Cancelling a caller sharing the call doesn't cancel it for the others."""
+
+    async def run():
+        cache = AnswerCache()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return "Google Cloud is a cloud platform."
+
+        leader, cancelled, follower = await start_lookups(cache, fetch, 3)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await leader == "Google Cloud is a cloud platform."
+        assert await follower == "Google Cloud is a cloud platform."
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert cache.stats()["size"] == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_leader_hands_the_call_over():
+    """Cancelling the caller of the shared call makes another one call again."""
+
+    async def run():
+        cache = AnswerCache()
+        calls = []
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(None)
+            await release.wait()
+            return "Google Cloud is a cloud platform."
+
+        leader, *followers = await start_lookups(cache, fetch, 3)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await asyncio.gather(*followers) == [
+            "Google Cloud is a cloud platform.",
+        ] * 2
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert len(calls) == 2
+        stats = cache.stats()
+        assert (stats["lookups"], stats["calls"]) == (3, 2)
+
+    asyncio.run(run())
+
+
+def test_failed_call_fails_every_caller():
+    """The error of the shared call is raised to every caller sharing it."""
+
+    async def run():
+        cache = AnswerCache()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            raise RuntimeError("knowledge base unavailable")
+
+        tasks = await start_lookups(cache, fetch, 2)
+        release.set()
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert [type(r) for r in results] == [RuntimeError] * 2
+        assert cache.stats()["size"] == 0
+
+    asyncio.run(run())
+
+
+def test_fallback_answers_are_not_cached():
+    """The answers the knowledge base flags as its fallback are not cached."""
+    cache = AnswerCache(accept=is_answer)
+    fallback = {"output": "I'm sorry...", "fallback": True}
+    answer = {"output": "Google Cloud is a cloud platform.", "fallback": False}
+
+    assert cache.get("What is Google Cloud?", lambda: fallback) == fallback
+    assert cache.get("What is Google Cloud?", lambda: answer) == answer
+    assert cache.get("What is Google Cloud?", lambda: fallback) == answer
@@ -0,0 +1,65 @@
+"""Tests of the background writes of the sessions."""
+import time
+
+from agent.history import SessionWriter
+
+
+def make_turn(turn: int) -> dict:
+    """Make a turn of a session."""
+    return {"turn": turn, "question": f"Question {turn}", "answer": "Answer"}
+
+
+class FlakyStore:
+    """Session writes failing a number of times before they succeed."""
+
+    def __init__(self, failures: int):
+        """Initialize the store."""
+        self.failures = failures
+        self.writes = []
+
+    def write(self, session_id: str, session: dict, turns: list):
+        """Write a session, or fail."""
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Datastore unavailable")
+        self.writes.append((session_id, session["version"], [t["turn"] for t in turns]))
+
+
+def test_failed_write_is_retried():
+    """A failed write is written again, after a backoff."""
+    store = FlakyStore(failures=2)
+    writer = SessionWriter(store.write, threads=1, retries=3, backoff=0.01)
+
+    writer.put("session", {"version": 1}, [make_turn(1)])
+    writer.flush()
+
+    assert store.writes == [("session", 1, [1])]
+    stats = writer.stats()
+    assert (stats["errors"], stats["retried"], stats["dropped_turns"]) == (2, 2, 0)
+
+
+def test_failed_write_is_merged_with_newer_ones():
+    """A retried write carries the turns and the session queued since."""
+    store = FlakyStore(failures=1)
+    writer = SessionWriter(store.write, threads=1, retries=3, backoff=0.2)
+
+    writer.put("session", {"version": 1}, [make_turn(1)])
+    while not writer.stats()["errors"]:
+        time.sleep(0.01)
+    writer.put("session", {"version": 2}, [make_turn(2)])
+    writer.flush()
+
+    assert store.writes == [("session", 2, [1, 2])]
+
+
+def test_write_failing_too_often_is_dropped():
+    """The turns of a write failing every retry are dropped, and counted."""
+    store = FlakyStore(failures=10)
+    writer = SessionWriter(store.write, threads=1, retries=2, backoff=0.01)
+
+    writer.put("session", {"version": 1}, [make_turn(1), make_turn(2)])
+    writer.flush()
+
+    assert store.writes == []
+    stats = writer.stats()
+    assert (stats["errors"], stats["dropped_turns"], stats["pending"]) == (3, 2, 0)
@@ -0,0 +1,33 @@
+"""Tests of the session stores."""
+from google.cloud import datastore
+
+from agent import store
+
+
+class FakeDatastoreClient:
+    """Datastore client recording the batches it writes."""
+
+    def __init__(self):
+        """Initialize the client."""
+        self.batches = []
+
+    def key(self, *path, parent=None):
+        """Get a key, in a test project."""
+        return datastore.Key(*path, parent=parent, project="test")
+
+    def put_multi(self, entities):
+        """Record a batch of entities."""
+        assert len(entities) <= 500
+        self.batches.append(entities)
+
+
+def test_datastore_put_writes_in_batches_session_last(monkeypatch):
+    """A migrated session with many turns is written in batches of 500."""
+    client = FakeDatastoreClient()
+    monkeypatch.setattr(store, "get_datastore_client", lambda: client)
+    turns = [{"turn": n, "question": "q", "answer": "a"} for n in range(1, 1001)]
+
+    store.DatastoreSessionStore().put("session", turns, {"version": 1})
+
+    assert [len(batch) for batch in client.batches] == [500, 500, 1]
+    assert client.batches[-1][0].key.kind == store.DATASTORE_SESSION_ENTITY_NAME
@@ -1,5 +1,5 @@
 """Agent coordinator."""
-from typing import Any, Dict, List, Optional, cast
+from typing import Any, AsyncIterator, Dict, List, Optional, cast
 
 from langchain.agents import AgentExecutor
 from langchain.agents.format_scratchpad import format_to_openai_function_messages
@@ -11,18 +11,36 @@ from langchain.prompts.chat import (
 )
 from langchain.prompts.prompt import PromptTemplate
 from langchain.pydantic_v1 import BaseModel, Field
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun
+from langchain_core.language_models import BaseChatModel
 from langchain_core.runnables import (
     ConfigurableFieldSpec,
     Runnable,
     RunnableConfig,
+    ensure_config,
 )
-from langchain_core.runnables.utils import Input, Output
+from langchain_core.runnables.utils import AddableDict, Input, Output
+from langchain_core.tools import BaseTool
+from langchain_core.utils.aiter import py_anext
 from langchain_google_vertexai.chat_models import ChatVertexAI
 from unidecode import unidecode
-from vertexai.generative_models._generative_models import ResponseBlockedError
 
+from agent.auth import AUTHORIZATION_TOKEN
 from agent.tools.general import get_all_tools
 from agent.output_parser import CustomOutputParser
+from agent.retries import (
+    arun_with_retries,
+    astream_with_retries,
+    run_with_retries,
+)
+from agent.streaming import (
+    ANSWER_TAG,
+    AnswerStream,
+    StreamingChatVertexAI,
+    aiter_input,
+    format_action,
+    format_step,
+)
 
 
 FALLBACK_MESSAGE = (
@@ -41,6 +59,7 @@ class OutputChat(BaseModel):
     """Output for the chat endpoint."""
 
     output: str = Field("output from the agent")
+    fallback: bool = Field(False, description="whether the agent couldn't help")
 
 
 def postprocess_output(output: str) -> str:
@@ -62,105 +81,205 @@ def simple_responsible_ai_filter(message: str) -> str:
     return message
 
 
+def check_answer(output: Optional[str]) -> str:
+    """Postprocess the output of the agent, and filter it."""
+    return simple_responsible_ai_filter(postprocess_output(output or ""))
+
+
+CHAT_PROMPT = ChatPromptTemplate(
+    input_variables=[
+        "agent_scratchpad",
+        "message",
+    ],
+    messages=[
+        HumanMessagePromptTemplate(
+            prompt=PromptTemplate(
+                input_variables=[],
+                template=(
+                    "You are a knowledge base. You help users find "
+                    "answers to their questions. Before giving an answer "
+                    "to the user, you must first rewrite the answer to "
+                    "match your personality using your tool. Don't "
+                    "ever say that your answer has been rewritten."
+                ),
+            ),
+        ),
+        AIMessagePromptTemplate(
+            prompt=PromptTemplate(
+                input_variables=[],
+                template=("Understood!"),
+            )
+        ),
+        HumanMessagePromptTemplate(
+            prompt=PromptTemplate(
+                input_variables=["message"],
+                template="{message}",
+            ),
+        ),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ],
+)
+
+
+def get_llm() -> ChatVertexAI:
+    """Get the LLM used by the agent."""
+    return StreamingChatVertexAI(
+        model_name="gemini-pro",
+        max_output_tokens=8192,
+        temperature=0.0,
+    )
+
+
+def get_agent(llm: BaseChatModel, tools: List[BaseTool]) -> Runnable:
+    """Get the agent runnable, deciding on the next step."""
+    llm_with_tools = llm.bind(functions=tools).with_config(tags=[ANSWER_TAG])
+
+    return (
+        {
+            "message": lambda x: unidecode(x["message"]),
+            "agent_scratchpad": lambda x: format_to_openai_function_messages(
+                x.get("checkpoint", []) + x["intermediate_steps"]
+            ),
+        }
+        | CHAT_PROMPT
+        | llm_with_tools
+        | CustomOutputParser(
+            pydantic_schema={tool.name: tool.args_schema for tool in tools},
+        )
+    )
+
+
 class CustomAgentExecutor(Runnable):
     """A custom runnable that will be used by the agent executor."""
 
-    def __init__(self, **kwargs):
-        """Initialize the runnable."""
+    def __init__(self, llm: Optional[BaseChatModel] = None, **kwargs):
+        """Initialize the runnable.
+
+        The prompt, the LLM client and the agent executor are built once and
+        shared by all requests. The tools read the authorization token of the
+        current request from `AUTHORIZATION_TOKEN`, set from the run config.
+        """
         super().__init__(**kwargs)
+        self.llm = llm or get_llm()
+        self.tools = get_all_tools()
+        self.agent_executor = AgentExecutor(
+            agent=get_agent(self.llm, self.tools),
+            tools=self.tools,
+            verbose=True,
+            max_iterations=15,
+            handle_parsing_errors=FALLBACK_MESSAGE,
+            return_intermediate_steps=True,
+        )
 
     def invoke(self, input: Input, config: Optional[RunnableConfig] = None) -> Output:
         """Invoke custom agent."""
         configurable = cast(Dict[str, Any], config.pop("configurable", {}))
+        token = AUTHORIZATION_TOKEN.set(configurable["authorization_token"])
+        try:
+            return self._invoke(input, config)
+        finally:
+            AUTHORIZATION_TOKEN.reset(token)
 
-        tools = get_all_tools(configurable["authorization_token"])
-        chat_prompt = ChatPromptTemplate(
-            input_variables=[
-                "agent_scratchpad",
-                "message",
-            ],
-            messages=[
-                HumanMessagePromptTemplate(
-                    prompt=PromptTemplate(
-                        input_variables=[],
-                        template=(
-                            "You are a knowledge base. You help users find "
-                            "answers to their questions. Before giving an answer "
-                            "to the user, you must first rewrite the answer to "
-                            "match your personality using your tool. Don't "
-                            "ever say that your answer has been rewritten."
-                        ),
-                    ),
-                ),
-                AIMessagePromptTemplate(
-                    prompt=PromptTemplate(
-                        input_variables=[],
-                        template=("Understood!"),
-                    )
-                ),
-                HumanMessagePromptTemplate(
-                    prompt=PromptTemplate(
-                        input_variables=["message"],
-                        template="{message}",
-                    ),
-                ),
-                MessagesPlaceholder(variable_name="agent_scratchpad"),
-            ],
-        )
-        llm = ChatVertexAI(
-            model_name="gemini-pro",
-            max_output_tokens=8192,
-            temperature=0.0,
-        )
-        llm_with_tools = llm.bind(functions=tools)
+    async def ainvoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        """Invoke custom agent asynchronously."""
+        configurable = cast(Dict[str, Any], config.pop("configurable", {}))
+        token = AUTHORIZATION_TOKEN.set(configurable["authorization_token"])
+        try:
+            return await self._ainvoke(input, config)
+        finally:
+            AUTHORIZATION_TOKEN.reset(token)
+
+    async def astream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        """Stream the tool calls of the agent and the tokens of its answer."""
+        config = ensure_config(config)
+        configurable = cast(Dict[str, Any], config.pop("configurable", {}))
+        token = AUTHORIZATION_TOKEN.set(configurable["authorization_token"])
+        try:
+            async for chunk in self._atransform_stream_with_config(
+                aiter_input(input), self._astream, config
+            ):
+                yield chunk
+        finally:
+            AUTHORIZATION_TOKEN.reset(token)
 
-        agent = (
+    def _invoke(self, input: Input, config: RunnableConfig) -> Output:
+        answer, _ = run_with_retries(
+            self.agent_executor,
             {
-                "message": lambda x: unidecode(x["message"]),
-                "agent_scratchpad": lambda x: format_to_openai_function_messages(
-                    x["intermediate_steps"]
-                ),
-            }
-            | chat_prompt
-            | llm_with_tools
-            | CustomOutputParser(
-                pydantic_schema={tool.name: tool.args_schema for tool in tools},
-            )
+                "message": unidecode(input["message"]),
+            },
+            config,
+            check_answer,
+            FALLBACK_MESSAGE,
         )
 
-        agent_executor = AgentExecutor(
-            agent=agent,
-            tools=tools,
-            verbose=True,
-            max_iterations=15,
-            handle_parsing_errors=FALLBACK_MESSAGE,
-            return_intermediate_steps=True,
-        )
+        return {
+            "output": answer,
+            "fallback": answer == FALLBACK_MESSAGE,
+        }
 
-        remaining_tries = 2
-        while remaining_tries > 0:
-            answer = None
-            try:
-                agent_output = agent_executor.invoke(
-                    input={
-                        "message": unidecode(input["message"]),
-                    },
-                    config=config,
-                )
-                answer = postprocess_output(agent_output["output"])
-                answer = simple_responsible_ai_filter(answer)
-            except ResponseBlockedError:
-                answer = FALLBACK_MESSAGE
-
-            if answer != FALLBACK_MESSAGE:
-                break
-
-            remaining_tries -= 1
+    async def _ainvoke(self, input: Input, config: RunnableConfig) -> Output:
+        answer, _ = await arun_with_retries(
+            self.agent_executor,
+            {
+                "message": unidecode(input["message"]),
+            },
+            config,
+            check_answer,
+            FALLBACK_MESSAGE,
+        )
 
         return {
             "output": answer,
+            "fallback": answer == FALLBACK_MESSAGE,
         }
 
+    async def _astream(
+        self,
+        input_iterator: AsyncIterator[Input],
+        run_manager: AsyncCallbackManagerForChainRun,
+        config: RunnableConfig,
+    ) -> AsyncIterator[Output]:
+        input = await py_anext(input_iterator)
+        answer_stream = AnswerStream(simple_responsible_ai_filter)
+
+        answer = FALLBACK_MESSAGE
+        async for kind, value in astream_with_retries(
+            self.agent_executor,
+            {"message": unidecode(input["message"])},
+            config,
+            run_manager,
+            check_answer,
+            FALLBACK_MESSAGE,
+            # Once part of the answer was sent, it can't be retried
+            can_retry=lambda: not answer_stream.released,
+        ):
+            if kind == "actions":
+                yield AddableDict(actions=[format_action(a) for a in value])
+            elif kind == "steps":
+                yield AddableDict(steps=[format_step(s) for s in value])
+            elif kind == "function_call":
+                answer_stream.on_function_call(value)
+            elif kind == "token":
+                text = answer_stream.on_token(*value)
+                if text:
+                    yield AddableDict(output=text)
+            elif kind == "answer":
+                answer = value
+
+        if answer != FALLBACK_MESSAGE:
+            text = answer_stream.on_answer(answer)
+            if text:
+                yield AddableDict(output=text)
+        elif answer_stream.released:
+            yield AddableDict(output="\n\n" + FALLBACK_MESSAGE)
+        else:
+            yield AddableDict(output=FALLBACK_MESSAGE)
+
     @property
     def config_specs(self) -> List[ConfigurableFieldSpec]:
         """Get config specs."""
@@ -1,10 +1,14 @@
 """General utilities for tools."""
 from langchain_core.tools import Tool
 
-from agent.tools.rewrite_answer import rewrite_answer_tool, RewriteAnswerInput
+from agent.tools.rewrite_answer import (
+    arewrite_answer_tool,
+    rewrite_answer_tool,
+    RewriteAnswerInput,
+)
 
 
-def get_all_tools(authorization_token: str):
+def get_all_tools():
     """Get all tools."""
     return [
         Tool(
@@ -14,7 +18,8 @@ def get_all_tools(authorization_token: str):
                 "Input is your answer. "
                 "Output is the rewritten answer."
             ),
-            func=rewrite_answer_tool(authorization_token),
+            func=rewrite_answer_tool,
+            coroutine=arewrite_answer_tool,
             args_schema=RewriteAnswerInput,
         ),
     ]
@@ -1,10 +1,10 @@
 """Rewrite answer tool."""
 import os
 
-import google.auth.transport.requests
-import google.oauth2.id_token
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langserve import RemoteRunnable
+
+from agent.auth import AUTHORIZATION_TOKEN, ID_TOKENS
+from agent.remote import get_agent_runnable
 
 
 class RewriteAnswerInput(BaseModel):
@@ -15,35 +15,50 @@ class RewriteAnswerInput(BaseModel):
     )
 
 
-def rewrite_answer_tool(authorization_token: str):
+AGENT_COORDINATOR_URL = os.environ.get("_AGENT_COORDINATOR_URL")
+
+
+def get_authorization() -> str:
+    """Get the authorization header of a request to the coordinator."""
+    if AGENT_COORDINATOR_URL:
+        return f"Bearer {ID_TOKENS.get(AGENT_COORDINATOR_URL)}"
+
+    return AUTHORIZATION_TOKEN.get()
+
+
+def rewrite_answer_tool(answer: str):
     """Rewrite answer."""
+    chat = get_agent_runnable(
+        "coordinator",
+        AGENT_COORDINATOR_URL or "http://localhost:8080/",
+        get_authorization,
+    )
+    answer = chat.invoke(
+        {
+            "message": (
+                "Please rewrite the following answer to match your personality: "
+                f"{answer}"
+            ),
+            "session_id": "knowledge-base",
+        },
+    )["output"]
+    return answer
+
 
-    def _wrapper(answer: str):
-        cloud_run_id_token = None
-        agent_coordinator_url = os.environ.get("_AGENT_COORDINATOR_URL")
-        if agent_coordinator_url:
-            auth_req = google.auth.transport.requests.Request()
-            cloud_run_id_token = google.oauth2.id_token.fetch_id_token(
-                auth_req,
-                agent_coordinator_url,
-            )
-
-        chat = RemoteRunnable(
-            agent_coordinator_url or "http://localhost:8080/",
-            headers={
-                "Authorization": (
-                    f"Bearer {cloud_run_id_token}"
-                    if cloud_run_id_token
-                    else authorization_token
-                ),
-            },
-        )
-        answer = chat.invoke(
-            {
-                "message": f"Please rewrite the following answer to match your personality: {answer}",
-                "session_id": "knowledge-base",
-            },
-        )["output"]
-        return answer
-
-    return _wrapper
+async def arewrite_answer_tool(answer: str):
+    """Rewrite answer, asynchronously."""
+    chat = get_agent_runnable(
+        "coordinator",
+        AGENT_COORDINATOR_URL or "http://localhost:8080/",
+        get_authorization,
+    )
+    answer = await chat.ainvoke(
+        {
+            "message": (
+                "Please rewrite the following answer to match your personality: "
+                f"{answer}"
+            ),
+            "session_id": "knowledge-base",
+        },
+    )
+    return answer["output"]
@@ -5,7 +5,10 @@ from typing import Dict
 from fastapi import FastAPI, HTTPException, Request
 from langserve import add_routes
 
+from agent.auth import ID_TOKENS
 from agent.knowledge_base import get_agent_knowledge_base
+from agent.remote import get_connection_stats
+from agent.retries import RETRY_STATS
 
 
 PORT = int(os.getenv("AIP_HTTP_PORT", "8081"))
@@ -34,10 +37,20 @@ add_routes(
     app,
     get_agent_knowledge_base(),
     per_req_config_modifier=per_req_config_modifier,
-    enabled_endpoints=["invoke"],
+    enabled_endpoints=["invoke", "stream", "stream_events"],
 )
 
 
+@app.get("/stats")
+def stats() -> Dict:
+    """Get the stats of the calls to the other agents and of the retries."""
+    return {
+        "connections": get_connection_stats(),
+        "id_tokens": ID_TOKENS.stats(),
+        "retries": RETRY_STATS.to_dict(),
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
 
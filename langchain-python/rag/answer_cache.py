@@ -0,0 +1,116 @@
+"""Cache of answers to questions already asked."""
+from collections import OrderedDict
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+
+def normalize_question(question):
+    """Normalize a question so that trivially different copies share a key."""
+    question = unicodedata.normalize("NFKC", question).casefold()
+    return " ".join(question.split()).rstrip(" ?!.")
+
+
+class AnswerCache:
+    """LRU cache of answers with a time to live and an optional semantic tier.
+
+    Answers are looked up by normalized question first. If an `embedding` model
+    and a `similarity` threshold are given, a question missing from the cache
+    then reuses the answer of the cached question whose embedding has the
+    highest cosine similarity with it, as long as it reaches the threshold.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, embedding=None, similarity=None):
+        """Create an empty cache."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embedding = embedding
+        self.similarity = similarity
+        self.index_version = None
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def semantic(self):
+        """Tell whether the semantic tier is enabled."""
+        return self.embedding is not None and self.similarity is not None
+
+    def _expire(self, now):
+        for key in [k for k, e in self._entries.items() if e["expires"] <= now]:
+            del self._entries[key]
+
+    def _hit(self, key, entry, start):
+        self._entries.move_to_end(key)
+        self.saved_seconds += max(entry["latency"] - (time.perf_counter() - start), 0)
+        return entry["answer"]
+
+    def validate(self, index_version):
+        """Drop every answer if the index changed since they were cached."""
+        with self._lock:
+            if index_version != self.index_version:
+                self._entries.clear()
+                self.index_version = index_version
+
+    def get(self, question):
+        """Get the cached answer to a question, or None."""
+        start = time.perf_counter()
+        key = normalize_question(question)
+        with self._lock:
+            self._expire(time.time())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return self._hit(key, entry, start)
+            if not self.semantic or not self._entries:
+                self.misses += 1
+                return None
+
+        vector = self._embed(key)
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if e["vector"] is not None]
+            if keys:
+                scores = np.stack([self._entries[k]["vector"] for k in keys]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return self._hit(keys[best], self._entries[keys[best]], start)
+            self.misses += 1
+            return None
+
+    def put(self, question, answer, latency):
+        """Cache the answer to a question, which took `latency` seconds."""
+        key = normalize_question(question)
+        vector = self._embed(key) if self.semantic else None
+        with self._lock:
+            self._entries[key] = {
+                "answer": answer,
+                "vector": vector,
+                "latency": latency,
+                "expires": time.time() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _embed(self, text):
+        vector = np.asarray(self.embedding.embed_query(text), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def stats(self):
+        """Get the hit rates and the generation time saved by the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
@@ -0,0 +1,214 @@
+"""Benchmark the split/index/retrieve path offline, for every vector backend.
+
+Runs against the pages bundled in `benchmark_corpus` with deterministic fake
+embeddings, so it needs neither Vertex AI nor network access:
+
+    python benchmark.py [--scale 20] [--json]
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+
+
+BACKENDS = ("chroma", "numpy")
+BENCHMARK_CORPUS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmark_corpus"
+)
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic unit vectors seeded by a hash of the text, for offline runs."""
+
+    def __init__(self, size=768):
+        """Set the embedding size."""
+        self.size = size
+
+    def _embed(self, text):
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        """Embed documents."""
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        """Embed a query."""
+        return self._embed(text)
+
+
+def load_corpus(path=BENCHMARK_CORPUS, scale=1):
+    """Load the bundled pages, plus `scale - 1` copies with shuffled paragraphs."""
+    pages = []
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), encoding="utf-8") as f:
+            pages.append((name, f.read()))
+
+    documents = []
+    for copy in range(scale):
+        rng = random.Random(copy)
+        for name, text in pages:
+            paragraphs = text.split("\n\n")
+            if copy:
+                rng.shuffle(paragraphs)
+            documents.append(
+                Document(
+                    page_content="\n\n".join(paragraphs),
+                    metadata={"source": f"https://example.com/{copy}/{name}"},
+                )
+            )
+    return documents
+
+
+def sample_queries(documents, count, seed=0):
+    """Pick sentences of the corpus to use as queries."""
+    sentences = [
+        sentence.strip()
+        for document in documents
+        for sentence in document.page_content.split(". ")
+        if len(sentence.split()) > 5
+    ]
+    return random.Random(seed).choices(sentences, k=count)
+
+
+def percentile(values, q):
+    """Get the q-th percentile of a list of values."""
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def batch_search(vectorstore, embeddings, k):
+    """Get the ids of the k most similar chunks to each of a batch of embeddings."""
+    from index import chunk_id
+
+    if hasattr(vectorstore, "similarity_search_by_vector_with_scores"):
+        results = vectorstore.similarity_search_by_vector_with_scores(embeddings, k)
+        metadatas = [[document.metadata for document, _ in row] for row in results]
+    else:
+        metadatas = vectorstore._collection.query(
+            query_embeddings=embeddings, n_results=k, include=["metadatas"]
+        )["metadatas"]
+    return [
+        [chunk_id(metadata["source"], metadata["start_index"]) for metadata in row]
+        for row in metadatas
+    ]
+
+
+def recall_at_k(splits, embedding, query_embeddings, found, k):
+    """Get the recall of the found ids against an exact search, counting ties."""
+    from index import chunk_id
+    from numpy_index import normalize
+
+    matrix = normalize(embedding.embed_documents([s.page_content for s in splits]))
+    scores = normalize(query_embeddings) @ matrix.T
+    positions = {
+        chunk_id(split.metadata["source"], split.metadata["start_index"]): i
+        for i, split in enumerate(splits)
+    }
+    recalls = []
+    for row_scores, ids in zip(scores, found):
+        # A result is correct if it scores at least as high as the true k-th result
+        kth_score = np.sort(row_scores)[-k]
+        recalls.append(
+            sum(row_scores[positions[id_]] >= kth_score - 1e-6 for id_ in ids) / k
+        )
+    return statistics.mean(recalls)
+
+
+def run_backend(backend, documents, queries, size, k, batch_size):
+    """Build an index with one backend, then measure its latency and recall."""
+    from index import build_index, split_documents
+
+    embedding = FakeEmbeddings(size)
+    with tempfile.TemporaryDirectory() as index_dir:
+        start = time.perf_counter()
+        vectorstore, pipeline = build_index(
+            index_dir, embedding, backend, documents=documents
+        )
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            vectorstore.similarity_search(query, k=k)
+            latencies.append(time.perf_counter() - start)
+
+        query_embeddings = embedding.embed_documents(queries)
+        found = []
+        start = time.perf_counter()
+        for i in range(0, len(queries), batch_size):
+            found += batch_search(vectorstore, query_embeddings[i : i + batch_size], k)
+        batch_seconds = time.perf_counter() - start
+
+    recall = recall_at_k(
+        split_documents(documents), embedding, query_embeddings, found, k
+    )
+
+    return {
+        "backend": backend,
+        "chunks": pipeline.changes["added"],
+        "build_seconds": round(build_seconds, 3),
+        "query_ms_p50": round(percentile(latencies, 50) * 1000, 3),
+        "query_ms_p95": round(percentile(latencies, 95) * 1000, 3),
+        "query_ms_p99": round(percentile(latencies, 99) * 1000, 3),
+        "batch_queries_per_second": round(len(queries) / batch_seconds, 1),
+        f"recall_at_{k}": round(recall, 4),
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--scale", type=int, default=1, help="number of copies of the corpus"
+    )
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--size", type=int, default=768, help="embedding size")
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    corpus = load_corpus(scale=args.scale)
+    questions = sample_queries(corpus, args.queries)
+    results = []
+    # Each backend runs in a fresh process so that peak RSS is measured separately
+    context = multiprocessing.get_context("spawn")
+    for name in args.backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results.append(
+                pool.submit(
+                    run_backend,
+                    name,
+                    corpus,
+                    questions,
+                    args.size,
+                    args.k,
+                    args.batch_size,
+                ).result()
+            )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['backend']}:")
+            for metric, value in result.items():
+                if metric != "backend":
+                    print(f"  {metric:<26}{value}")
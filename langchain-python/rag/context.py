@@ -0,0 +1,103 @@
+"""Pack retrieved chunks into the prompt context."""
+import os
+import threading
+
+
+CONTEXT_TOKENS = int(os.environ.get("CONTEXT_TOKENS", "1500"))
+
+
+def approximate_tokens(text):
+    """Estimate the number of tokens of a text (about 4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def merge_spans(spans):
+    """Merge the overlapping or adjacent (start, text, rank) spans of a page.
+
+    A merged span keeps the best rank of its spans.
+    """
+    merged = []
+    for start, text, rank in sorted(spans, key=lambda span: span[0]):
+        if merged and start <= merged[-1][0] + len(merged[-1][1]):
+            m_start, m_text, m_rank = merged[-1]
+            tail = text[m_start + len(m_text) - start :]
+            merged[-1] = (m_start, m_text + tail, min(m_rank, rank))
+        else:
+            merged.append((start, text, rank))
+    return merged
+
+
+class ContextPacker:
+    """Merge overlapping chunks and fill a token budget in relevance order.
+
+    Chunks of the same page overlap by up to `chunk_overlap` characters, so
+    their `start_index` is used to merge overlapping or adjacent chunks into a
+    single passage, and to drop chunks already contained in another one,
+    whatever the order they were retrieved in. Chunks are taken in retrieval
+    order and skipped when the text they would add does not fit in the
+    remaining budget. Passages are separated by blank lines, the one holding
+    the most relevant chunk first.
+    """
+
+    def __init__(self, max_tokens=CONTEXT_TOKENS, count_tokens=approximate_tokens):
+        """Configure the token budget."""
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self._lock = threading.Lock()
+
+    def pack(self, docs):
+        """Get the passages to put in the context, as (source, start, text)."""
+        spans = {}
+        loose = []
+        used = 0
+        for rank, doc in enumerate(docs):
+            text = doc.page_content
+            start = doc.metadata.get("start_index")
+            source = doc.metadata.get("source")
+            if start is None:
+                cost = self.count_tokens(text)
+                if used + cost <= self.max_tokens:
+                    loose.append((rank, source, start, text))
+                    used += cost
+                continue
+
+            # A chunk can bridge passages of its page, so they are merged again
+            accepted = spans.get(source, [])
+            candidate = accepted + [(start, text, rank)]
+            cost = self._count_spans(candidate) - self._count_spans(accepted)
+            if used + cost <= self.max_tokens:
+                spans[source] = candidate
+                used += cost
+
+        passages = loose + [
+            (rank, source, start, text)
+            for source, page_spans in spans.items()
+            for start, text, rank in merge_spans(page_spans)
+        ]
+        return [passage[1:] for passage in sorted(passages, key=lambda p: p[0])]
+
+    def _count_spans(self, spans):
+        return sum(self.count_tokens(text) for _, text, _ in merge_spans(spans))
+
+    def __call__(self, docs):
+        """Format the retrieved chunks into the context, counting the tokens saved."""
+        context = "\n\n".join(text for _, _, text in self.pack(docs))
+        before = self.count_tokens("\n\n".join(doc.page_content for doc in docs))
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += before
+            self.tokens_after += self.count_tokens(context)
+        return context
+
+    def stats(self):
+        """Get the context tokens before and after packing."""
+        before, after = self.tokens_before, self.tokens_after
+        return {
+            "requests": self.requests,
+            "tokens_before": before,
+            "tokens_after": after,
+            "saved_ratio": 1 - after / before if before else 0.0,
+        }
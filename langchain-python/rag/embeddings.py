@@ -0,0 +1,198 @@
+"""Content-addressed cache in front of an embedding model."""
+from array import array
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from langchain.schema.embeddings import Embeddings
+
+
+EMBEDDINGS_CACHE = os.environ.get(
+    "EMBEDDINGS_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "embeddings.db"),
+)
+# Maximum number of texts per request accepted by Vertex AI text embedding models
+BATCH_SIZE = 5
+MAX_ENTRIES = 200_000
+# Seconds between two writes of when the cache hits were last used
+USED_FLUSH_INTERVAL = float(os.environ.get("EMBEDDINGS_CACHE_FLUSH_INTERVAL", "30"))
+# Version of the cache file: 1 stores the vectors as float32 instead of float64
+SCHEMA_VERSION = 1
+
+
+def normalize_text(text):
+    """Normalize a text so that trivially different copies share a cache key."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings keyed by a hash of (model name, normalized text).
+
+    Vectors are kept as float32 in a local SQLite file and the least recently
+    used ones are evicted once the cache holds more than `max_entries`. Lookups
+    only read the file: when the hits were used is kept in memory, and written
+    every `flush_interval` seconds or with the next cache misses. Only cache
+    misses are sent to the underlying model, de-duplicated and packed into full
+    batches.
+    """
+
+    def __init__(
+        self,
+        underlying,
+        path=EMBEDDINGS_CACHE,
+        max_entries=MAX_ENTRIES,
+        batch_size=BATCH_SIZE,
+        flush_interval=USED_FLUSH_INTERVAL,
+    ):
+        """Open (or create) the cache file."""
+        self.underlying = underlying
+        self.model_name = getattr(underlying, "model_name", type(underlying).__name__)
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._used = {}
+        self._used_flushed_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.backend_calls = 0
+        self.backend_seconds = 0.0
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, used INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS used ON embeddings (used)")
+        self._db.commit()
+        self._migrate()
+        self._clock = self._db.execute(
+            "SELECT COALESCE(MAX(used), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def _migrate(self):
+        # In a write transaction, so that only one worker converts the vectors
+        self._db.execute("BEGIN IMMEDIATE")
+        (version,) = self._db.execute("PRAGMA user_version").fetchone()
+        if version < 1:
+            rows = self._db.execute("SELECT key, vector FROM embeddings").fetchall()
+            self._db.executemany(
+                "UPDATE embeddings SET vector = ? WHERE key = ?",
+                [
+                    (array("f", array("d", vector)).tobytes(), key)
+                    for key, vector in rows
+                ],
+            )
+        self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.commit()
+
+    def _key(self, kind, text):
+        payload = "\0".join((self.model_name, kind, normalize_text(text)))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        unique = list(set(keys))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                batch = unique[i : i + 500]
+                rows = self._db.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = array("f", vector).tolist()
+            self._clock += 1
+            self._used.update(dict.fromkeys(found, self._clock))
+            if time.monotonic() - self._used_flushed_at >= self.flush_interval:
+                self._write_used()
+                self._db.commit()
+        return found
+
+    def _write_used(self):
+        if self._used:
+            self._db.executemany(
+                "UPDATE embeddings SET used = ? WHERE key = ?",
+                [(used, key) for key, used in self._used.items()],
+            )
+            self._used = {}
+        self._used_flushed_at = time.monotonic()
+
+    def _store(self, vectors):
+        with self._lock:
+            self._clock += 1
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, used) "
+                "VALUES (?, ?, ?)",
+                [
+                    (key, array("f", vector).tobytes(), self._clock)
+                    for key, vector in vectors.items()
+                ],
+            )
+            # Evict by the recency of the hits since the last write too
+            self._write_used()
+            (count,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._db.commit()
+
+    def _embed(self, kind, texts, embed_batch):
+        keys = [self._key(kind, text) for text in texts]
+        vectors = self._lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            computed = {}
+            items = list(missing.items())
+            for i in range(0, len(items), self.batch_size):
+                batch = items[i : i + self.batch_size]
+                start = time.perf_counter()
+                embedded = embed_batch([text for _, text in batch])
+                self.backend_seconds += time.perf_counter() - start
+                self.backend_calls += 1
+                computed.update(zip([key for key, _ in batch], embedded))
+            self._store(computed)
+            vectors.update(computed)
+
+        return [vectors[key] for key in keys]
+
+    def embed_documents(self, texts):
+        """Embed documents, only calling the model for texts not in the cache."""
+        return self._embed("document", texts, self.underlying.embed_documents)
+
+    def embed_query(self, text):
+        """Embed a query, only calling the model if it is not in the cache."""
+        return self._embed(
+            "query", [text], lambda t: [self.underlying.embed_query(t[0])]
+        )[0]
+
+    def stats(self):
+        """Get hit/miss counters and an estimate of the backend time saved."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "backend_calls": self.backend_calls,
+            "backend_seconds": self.backend_seconds,
+            "saved_seconds_estimate": (
+                self.hits * self.backend_seconds / self.misses if self.misses else 0.0
+            ),
+        }
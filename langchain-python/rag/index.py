@@ -0,0 +1,170 @@
+"""Build, refresh and open the persistent vector index."""
+from contextlib import closing, contextmanager
+import fcntl
+import hashlib
+import json
+import os
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Hack to get correct pysqlite3 version
+__import__("pysqlite3")
+import sys  # noqa: E402
+
+sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
+
+
+# Global Variables (CHANGE THESE)
+URL = "https://developers.google.com/machine-learning/guides/"
+# "chroma" or "numpy"
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma")
+INDEX_DIR = os.environ.get(
+    "INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "index", VECTOR_BACKEND),
+)
+MANIFEST_FILE = "manifest.json"
+
+
+def split_documents(documents):
+    """Split the documents into chunks so we can embed them."""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000, chunk_overlap=200, add_start_index=True
+    )
+    return text_splitter.split_documents(documents)
+
+
+def content_hash(text):
+    """Hash a text so we can detect when it changes."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source, start_index):
+    """Get the vector store id of a chunk."""
+    return f"{source}#{start_index}"
+
+
+def load_manifest(index_dir=INDEX_DIR):
+    """Load the build manifest, or an empty one if the index was never built."""
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"sources": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, index_dir=INDEX_DIR):
+    """Atomically write the build manifest next to the index."""
+    os.makedirs(index_dir, exist_ok=True)
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def index_version(index_dir=INDEX_DIR):
+    """Get a value that changes every time the index is refreshed."""
+    try:
+        return os.stat(os.path.join(index_dir, MANIFEST_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_embeddings():
+    """Get the Vertex AI embedding model behind the local embedding cache."""
+    from langchain.embeddings import VertexAIEmbeddings
+
+    from embeddings import CachedEmbeddings
+
+    return CachedEmbeddings(VertexAIEmbeddings())
+
+
+def open_vectorstore(index_dir=INDEX_DIR, embedding=None, backend=VECTOR_BACKEND):
+    """Open the on-disk vector store."""
+    if backend == "numpy":
+        from numpy_index import NumpyIndex
+
+        return NumpyIndex(embedding or get_embeddings(), path=index_dir)
+
+    from langchain.vectorstores import Chroma
+
+    return Chroma(
+        persist_directory=index_dir,
+        embedding_function=embedding or get_embeddings(),
+    )
+
+
+def build_index(
+    index_dir=INDEX_DIR, embedding=None, backend=VECTOR_BACKEND, documents=None
+):
+    """Crawl the website (unless documents are given) into the on-disk index."""
+    with index_lock(index_dir):
+        return _build_index(index_dir, embedding, backend, documents)
+
+
+def _build_index(index_dir, embedding, backend, documents):
+    from crawler import iter_crawl
+    from pipeline import IngestionPipeline
+
+    embedding = embedding or get_embeddings()
+    vectorstore = open_vectorstore(index_dir, embedding, backend)
+    manifest = load_manifest(index_dir)
+    pipeline = IngestionPipeline(vectorstore, embedding, manifest)
+    if documents is None:
+        # Closed even if the pipeline fails, which stops the crawl
+        with closing(iter_crawl(URL, max_depth=2)) as crawled:
+            pipeline.run(crawled)
+    else:
+        pipeline.run(documents)
+    if backend == "numpy":
+        vectorstore.save()
+    save_manifest(manifest, index_dir)
+    return vectorstore, pipeline
+
+
+@contextmanager
+def index_lock(index_dir=INDEX_DIR):
+    """Hold an exclusive lock on the index, shared by all processes on the host."""
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def ensure_index(index_dir=INDEX_DIR, embedding=None, backend=VECTOR_BACKEND):
+    """Build the index if there is none yet, once whatever the number of processes."""
+    with index_lock(index_dir):
+        if not os.path.exists(os.path.join(index_dir, MANIFEST_FILE)):
+            _build_index(index_dir, embedding, backend, None)
+
+
+def init_retriever(index_dir=INDEX_DIR, embedding=None, backend=VECTOR_BACKEND):
+    """Open the existing index read-only, building it first if there is none yet.
+
+    With the numpy backend the vectors are memory-mapped, so every worker
+    opening the same index shares a single copy of them in the page cache.
+    """
+    ensure_index(index_dir, embedding, backend)
+    vectorstore = open_vectorstore(index_dir, embedding, backend)
+    return vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 6})
+
+
+if __name__ == "__main__":
+    print(f"Refreshing index in {INDEX_DIR}...")
+    embedding_model = get_embeddings()
+    _, ingestion = build_index(embedding=embedding_model)
+    print(
+        f"{ingestion.changes['added']} chunks embedded, "
+        f"{ingestion.changes['deleted']} deleted, "
+        f"{ingestion.changes['unchanged']} unchanged."
+    )
+    print(ingestion.report())
+    cache_stats = embedding_model.stats()
+    print(
+        f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+        f"({cache_stats['hit_ratio']:.0%}), {cache_stats['backend_calls']} model calls "
+        f"in {cache_stats['backend_seconds']:.1f}s, "
+        f"~{cache_stats['saved_seconds_estimate']:.1f}s saved."
+    )
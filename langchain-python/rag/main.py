@@ -1,84 +1,222 @@
 """Prompt a model using most relevant samples."""
-from flask import Flask, request, make_response
-import os
-from langchain.document_loaders import RecursiveUrlLoader
-from bs4 import BeautifulSoup as Soup
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.llms import VertexAI
-from langchain import hub
-from langchain.schema import StrOutputParser
-from langchain.schema.runnable import RunnablePassthrough
+import time
 
-# Hack to get correct pysqlite3 version
-__import__("pysqlite3")
-import sys  # noqa: E402
+IMPORT_START = time.perf_counter()
 
-sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
+from contextlib import contextmanager  # noqa: E402
+import os  # noqa: E402
+import threading  # noqa: E402
+
+from flask import (  # noqa: E402
+    Flask,
+    Response,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+)
 
 
 app = Flask(__name__)
 
 # Global Variables (CHANGE THESE)
 PROJECT_ID = "PROJECT-ID"
-
-
-def load_documents():
-    """Load websites from URLs into LangChain documents."""
-    url = "https://developers.google.com/machine-learning/guides/"
-    loader = RecursiveUrlLoader(
-        url=url, max_depth=2, extractor=lambda x: Soup(x, "html.parser").text
+# Warm up in a background thread so the server accepts connections immediately
+BACKGROUND_WARMUP = os.environ.get("BACKGROUND_WARMUP", "1") == "1"
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "600"))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+# Set it (e.g. to 0.95) to reuse answers to similar questions, not only identical ones
+ANSWER_CACHE_SIMILARITY = os.environ.get("ANSWER_CACHE_SIMILARITY")
+
+WARMED_UP = threading.Event()
+TIMINGS = {}
+WARMUP_ERROR = None
+RETRIEVER = None
+# Version of the index the retriever was opened at
+INDEX_VERSION = None
+INDEX_RELOAD_LOCK = threading.Lock()
+EMBEDDING = None
+LLM = None
+PROMPT = None
+RAG_CHAIN = None
+ANSWER_CACHE = None
+CONTEXT_PACKER = None
+
+
+@contextmanager
+def timed(phase):
+    """Record how long a startup phase takes."""
+    start = time.perf_counter()
+    yield
+    TIMINGS[phase] = round(time.perf_counter() - start, 3)
+
+
+def build_chain(retriever, prompt, llm, context_packer):
+    """Build the RAG chain."""
+    from langchain.schema import StrOutputParser
+    from langchain.schema.runnable import RunnablePassthrough
+
+    return (
+        {"context": retriever | context_packer, "question": RunnablePassthrough()}
+        | prompt
+        | llm
+        | StrOutputParser()
     )
-    return loader.load()
 
 
-def split_documents(documents):
-    """Split the documents into chunks so we can embed them."""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000, chunk_overlap=200, add_start_index=True
+def warmup():
+    """Open the index and create the LLM, the prompt and the chain."""
+    global RETRIEVER, LLM, PROMPT, RAG_CHAIN, ANSWER_CACHE, CONTEXT_PACKER
+    global EMBEDDING, INDEX_VERSION, WARMUP_ERROR
+
+    try:
+        with timed("index"):
+            from index import get_embeddings, index_version, init_retriever
+
+            embedding = EMBEDDING = get_embeddings()
+            # Read before opening, so that a refresh in between is picked up
+            INDEX_VERSION = index_version()
+            RETRIEVER = init_retriever(embedding=embedding)
+        with timed("llm"):
+            from langchain.llms import VertexAI
+
+            LLM = VertexAI(temperature=0)
+        with timed("prompt"):
+            from prompt import PROMPT
+        with timed("chain"):
+            from context import ContextPacker
+
+            CONTEXT_PACKER = ContextPacker()
+            RAG_CHAIN = build_chain(RETRIEVER, PROMPT, LLM, CONTEXT_PACKER)
+        with timed("answer_cache"):
+            from answer_cache import AnswerCache
+
+            ANSWER_CACHE = AnswerCache(
+                max_entries=ANSWER_CACHE_SIZE,
+                ttl=ANSWER_CACHE_TTL,
+                embedding=embedding,
+                similarity=(
+                    float(ANSWER_CACHE_SIMILARITY) if ANSWER_CACHE_SIMILARITY else None
+                ),
+            )
+    except Exception as e:
+        WARMUP_ERROR = repr(e)
+        raise
+    finally:
+        WARMED_UP.set()
+
+    print(f"Ready, startup timings (s): {TIMINGS}")
+
+
+def is_ready():
+    """Tell whether the warmup finished successfully."""
+    return WARMED_UP.is_set() and WARMUP_ERROR is None
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Tell that the server is up, even while it warms up."""
+    return make_response("ok", 200)
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Tell whether the server can answer questions yet."""
+    return make_response(
+        jsonify(ready=is_ready(), timings=TIMINGS, error=WARMUP_ERROR),
+        200 if is_ready() else 503,
     )
-    return text_splitter.split_documents(documents)
 
 
-def init_retriever(all_splits):
-    """We now create a vectorstore so we can retrieve relevant embeddings."""
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Report the answer cache hit rates and the context tokens saved."""
+    if not is_ready():
+        return make_response("Service is not ready yet", 503)
+    return jsonify(answer_cache=ANSWER_CACHE.stats(), context=CONTEXT_PACKER.stats())
+
+
+def reload_index():
+    """Reopen the index and rebuild the chain if the index was refreshed."""
+    global RETRIEVER, RAG_CHAIN, INDEX_VERSION
+    from index import index_version, init_retriever
+
+    if index_version() == INDEX_VERSION:
+        return
+    with INDEX_RELOAD_LOCK:
+        version = index_version()
+        if version == INDEX_VERSION:
+            return
+        with timed("index_reload"):
+            RETRIEVER = init_retriever(embedding=EMBEDDING)
+            RAG_CHAIN = build_chain(RETRIEVER, PROMPT, LLM, CONTEXT_PACKER)
+            INDEX_VERSION = version
+    print(f"Reloaded the refreshed index in {TIMINGS['index_reload']}s")
+
+
+def answer(question):
+    """Stream the answer to a question, from the answer cache if possible."""
+    reload_index()
+    ANSWER_CACHE.validate(INDEX_VERSION)
+    cached = ANSWER_CACHE.get(question)
+    if cached is not None:
+        yield cached
+        return
+
+    start = time.perf_counter()
+    output = ""
+    for chunk in RAG_CHAIN.stream(question):
+        output += chunk
+        yield chunk
+    ANSWER_CACHE.put(question, output, time.perf_counter() - start)
 
-    from langchain.embeddings import VertexAIEmbeddings
-    from langchain.vectorstores import Chroma
 
-    vectorstore = Chroma.from_documents(
-        documents=all_splits, embedding=VertexAIEmbeddings()
-    )
+def sse_event(data, event=None):
+    """Format a server-sent event."""
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return "\n".join(lines) + "\n\n"
 
-    return vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 6})
 
+@app.route("/", methods=["POST"])
+def chat():
+    """Return a response to a question.
 
-def format_docs(docs):
-    return "\n\n".join(doc.page_content for doc in docs)
+    By default the whole answer is sent at once. Set `"stream": "text"` in the
+    request to receive it as chunked plain text while it is generated, or
+    `"stream": "sse"` (or send `Accept: text/event-stream`) to receive it as
+    server-sent events, ending with an `end` event.
+    """
+    if not WARMED_UP.wait(WARMUP_TIMEOUT) or WARMUP_ERROR:
+        return make_response("Service is not ready yet", 503)
 
+    user_question = request.json["question"]
+    stream = request.json.get("stream")
+    if stream is None and request.accept_mimetypes.best == "text/event-stream":
+        stream = "sse"
 
-documents = load_documents()
-splits = split_documents(documents)
+    if stream == "text":
+        return Response(
+            stream_with_context(answer(user_question)),
+            mimetype="text/plain",
+            headers={"X-Accel-Buffering": "no"},
+        )
 
-RETRIEVER = init_retriever(splits)
-LLM = VertexAI(temperature=0)
-PROMPT = hub.pull("rlm/rag-prompt")
+    if stream == "sse":
 
+        def events():
+            for chunk in answer(user_question):
+                yield sse_event(chunk)
+            yield sse_event("", event="end")
 
-@app.route("/", methods=["POST"])
-def chat():
-    """Return a response to a question."""
-    user_question = request.json["question"]
-
-    RAG_CHAIN = (
-        {"context": RETRIEVER | format_docs, "question": RunnablePassthrough()}
-        | PROMPT
-        | LLM
-        | StrOutputParser()
-    )
+        return Response(
+            stream_with_context(events()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
-    output = ""
-    for chunk in RAG_CHAIN.stream(user_question):
-        output += chunk
+    output = "".join(answer(user_question))
 
     # Send response
     response = make_response(output, 200)
@@ -86,6 +224,14 @@ def chat():
     return response
 
 
+TIMINGS["import"] = round(time.perf_counter() - IMPORT_START, 3)
+
+if BACKGROUND_WARMUP:
+    threading.Thread(target=warmup, daemon=True).start()
+else:
+    warmup()
+
+
 if __name__ == "__main__":
     print("Launching server...")
     app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
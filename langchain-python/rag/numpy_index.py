@@ -0,0 +1,188 @@
+"""In-process vector index backed by a NumPy matrix."""
+import json
+import os
+import uuid
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.vectorstore import VectorStore
+
+
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.json"
+
+
+def normalize(vectors):
+    """Scale vectors to unit length, so that dot products are cosine similarities."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class NumpyIndex(VectorStore):
+    """Exact cosine similarity search over a contiguous float32 matrix.
+
+    Embeddings are normalized and stored row by row in `vectors.npy`, and the
+    id, text and metadata of every row in the `chunks.json` side table. Saved
+    indexes are opened with `mmap_mode="r"`, so opening is instant and
+    processes opening the same files share their pages. A top-k search is a
+    single matrix product followed by a partial sort.
+    """
+
+    def __init__(self, embedding, path=None):
+        """Open the index saved in `path`, or create an empty one."""
+        self._embedding = embedding
+        self.path = path
+        self._vectors = None
+        self._chunks = []
+        self._pending = []
+        if path and os.path.exists(os.path.join(path, CHUNKS_FILE)):
+            with open(os.path.join(path, CHUNKS_FILE), encoding="utf-8") as f:
+                self._chunks = json.load(f)
+            if self._chunks:
+                self._vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        self._positions = {chunk["id"]: i for i, chunk in enumerate(self._chunks)}
+
+    @property
+    def embeddings(self):
+        """Get the embedding model."""
+        return self._embedding
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def _matrix(self):
+        if self._pending:
+            blocks = [self._vectors] if self._vectors is not None else []
+            self._vectors = np.concatenate(blocks + self._pending)
+            self._pending = []
+        return self._vectors
+
+    def __len__(self):
+        """Get the number of chunks in the index."""
+        return len(self._chunks)
+
+    def upsert(self, ids, texts, metadatas, embeddings):
+        """Insert or replace already embedded chunks.
+
+        When an id appears more than once, its last chunk is kept.
+        """
+        vectors = normalize(embeddings)
+        new_rows = {}
+        for id_, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+            chunk = {"id": id_, "text": text, "metadata": metadata or {}}
+            if id_ in new_rows:
+                # Added earlier in this batch, its row is not in the matrix yet
+                self._chunks[self._positions[id_]] = chunk
+                new_rows[id_] = vector
+            elif id_ in self._positions:
+                position = self._positions[id_]
+                matrix = self._matrix()
+                if not matrix.flags.writeable:
+                    self._vectors = matrix = np.array(matrix)
+                matrix[position] = vector
+                self._chunks[position] = chunk
+            else:
+                self._positions[id_] = len(self._chunks)
+                self._chunks.append(chunk)
+                new_rows[id_] = vector
+        if new_rows:
+            self._pending.append(np.stack(list(new_rows.values())))
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """Embed and add texts to the index."""
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        self.upsert(ids, texts, metadatas, self._embedding.embed_documents(texts))
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        """Delete chunks by id."""
+        positions = {self._positions[i] for i in ids or [] if i in self._positions}
+        if not positions:
+            return True
+        keep = np.array([i not in positions for i in range(len(self._chunks))])
+        self._vectors = self._matrix()[keep]
+        self._chunks = [c for i, c in enumerate(self._chunks) if keep[i]]
+        self._positions = {chunk["id"]: i for i, chunk in enumerate(self._chunks)}
+        return True
+
+    def save(self, path=None):
+        """Write the index to disk, replacing the previous files atomically."""
+        path = path or self.path
+        os.makedirs(path, exist_ok=True)
+        matrix = self._matrix()
+        if matrix is None:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        with open(os.path.join(path, VECTORS_FILE + ".tmp"), "wb") as f:
+            np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(os.path.join(path, CHUNKS_FILE + ".tmp"), "w", encoding="utf-8") as f:
+            json.dump(self._chunks, f)
+        os.replace(
+            os.path.join(path, VECTORS_FILE + ".tmp"), os.path.join(path, VECTORS_FILE)
+        )
+        os.replace(
+            os.path.join(path, CHUNKS_FILE + ".tmp"), os.path.join(path, CHUNKS_FILE)
+        )
+
+    def _top_k(self, scores, k):
+        k = min(k, scores.shape[-1])
+        if k == 0:
+            return np.zeros(scores.shape[:-1] + (0,), dtype=int)
+        top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1)
+        return np.take_along_axis(top, order, axis=-1)
+
+    def _document(self, position):
+        chunk = self._chunks[position]
+        return Document(page_content=chunk["text"], metadata=chunk["metadata"])
+
+    def similarity_search_by_vector_with_scores(self, embeddings, k=4):
+        """Get the k most similar chunks to each of a batch of query embeddings."""
+        matrix = self._matrix()
+        if matrix is None or not len(self._chunks):
+            return [[] for _ in embeddings]
+        scores = normalize(embeddings) @ matrix.T
+        top = self._top_k(scores, k)
+        return [
+            [(self._document(p), float(row_scores[p])) for p in row]
+            for row, row_scores in zip(top, scores)
+        ]
+
+    def batch_similarity_search(self, queries, k=4):
+        """Get the k most similar chunks to each query, in a single matrix product."""
+        embeddings = [self._embedding.embed_query(query) for query in queries]
+        return [
+            [document for document, _ in results]
+            for results in self.similarity_search_by_vector_with_scores(embeddings, k)
+        ]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        """Get the k most similar chunks to a query with their cosine similarity."""
+        embedding = self._embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_scores([embedding], k)[0]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        """Get the k most similar chunks to an embedding."""
+        return [
+            document
+            for document, _ in self.similarity_search_by_vector_with_scores(
+                [embedding], k
+            )[0]
+        ]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        """Get the k most similar chunks to a query."""
+        return [
+            document for document, _ in self.similarity_search_with_score(query, k)
+        ]
+
+    @classmethod
+    def from_texts(
+        cls, texts, embedding, metadatas=None, ids=None, path=None, **kwargs
+    ):
+        """Build an index from texts."""
+        index = cls(embedding, path=path)
+        index.add_texts(texts, metadatas=metadatas, ids=ids)
+        return index
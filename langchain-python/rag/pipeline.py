@@ -0,0 +1,258 @@
+"""Streaming ingestion pipeline: load -> split -> embed -> upsert."""
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+import os
+import queue
+import threading
+import time
+
+from index import chunk_id, content_hash, split_documents
+
+
+BATCH_SIZE = 64
+QUEUE_SIZE = 256
+STAGES = ("load", "split", "embed", "upsert")
+_DONE = object()
+
+
+def split_document(document):
+    """Split one document and hash its chunks (runs in a worker process)."""
+    return [
+        (
+            str(split.metadata["start_index"]),
+            content_hash(split.page_content),
+            split.page_content,
+            split.metadata,
+        )
+        for split in split_documents([document])
+    ]
+
+
+def upsert(vectorstore, ids, texts, metadatas, embeddings):
+    """Insert or replace already embedded chunks in the vector store."""
+    if hasattr(vectorstore, "upsert"):
+        return vectorstore.upsert(ids, texts, metadatas, embeddings)
+    vectorstore._collection.upsert(
+        ids=ids, embeddings=embeddings, metadatas=metadatas, documents=texts
+    )
+
+
+class IngestionPipeline:
+    """Bring a vector store up to date from a stream of documents.
+
+    Each stage runs in its own thread and hands its output to the next one
+    through a bounded queue, so a slow stage makes the previous ones wait
+    instead of piling up documents in memory: at any time only a few queues'
+    worth of chunks are held, whatever the size of the corpus.
+
+    The manifest keeps a hash of every source page and, for each page, a hash of
+    every chunk keyed on its `start_index`. Unchanged pages are skipped without
+    being split, and within a changed page only new or modified chunks are
+    embedded. Chunks and pages that disappeared are deleted.
+    """
+
+    def __init__(
+        self,
+        vectorstore,
+        embedding,
+        manifest,
+        batch_size=BATCH_SIZE,
+        queue_size=QUEUE_SIZE,
+        max_workers=None,
+    ):
+        """Configure the pipeline."""
+        self.vectorstore = vectorstore
+        self.embedding = embedding
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.changes = {"added": 0, "deleted": 0, "unchanged": 0}
+        self.stats = {
+            stage: {"items": 0, "seconds": 0.0, "waiting": 0.0, "blocked": 0.0}
+            for stage in STAGES
+        }
+        self._failed = threading.Event()
+        self._error = None
+
+    def _put(self, stage, out, item):
+        start = time.perf_counter()
+        while not self._failed.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.stats[stage]["blocked"] += time.perf_counter() - start
+        if self._failed.is_set():
+            raise RuntimeError("Ingestion aborted")
+
+    def _get(self, stage, source):
+        start = time.perf_counter()
+        while not self._failed.is_set():
+            try:
+                item = source.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        self.stats[stage]["waiting"] += time.perf_counter() - start
+        if self._failed.is_set():
+            raise RuntimeError("Ingestion aborted")
+        return item
+
+    def _load(self, documents):
+        iterator = iter(documents)
+        while True:
+            start = time.perf_counter()
+            document = next(iterator, _DONE)
+            self.stats["load"]["seconds"] += time.perf_counter() - start
+            if document is _DONE:
+                return
+            self.stats["load"]["items"] += 1
+            yield document
+
+    def _collect(self, in_flight, chunks, return_when):
+        done, _ = wait(in_flight, return_when=return_when)
+        sources = self.manifest["sources"]
+        for future in done:
+            source, page_hash = in_flight.pop(future)
+            old = sources.get(source, {"hash": None, "chunks": {}})
+            new_chunks = {}
+            for start_index, chunk_hash, text, metadata in future.result():
+                new_chunks[start_index] = chunk_hash
+                if old["chunks"].get(start_index) == chunk_hash:
+                    self.changes["unchanged"] += 1
+                else:
+                    self.changes["added"] += 1
+                    self._put(
+                        "split",
+                        chunks,
+                        ("upsert", chunk_id(source, start_index), text, metadata),
+                    )
+
+            removed = [s for s in old["chunks"] if s not in new_chunks]
+            if removed:
+                self.changes["deleted"] += len(removed)
+                self._put(
+                    "split", chunks, ("delete", [chunk_id(source, s) for s in removed])
+                )
+            sources[source] = {"hash": page_hash, "chunks": new_chunks}
+            self.stats["split"]["items"] += 1
+
+    def _split(self, documents, chunks):
+        sources = self.manifest["sources"]
+        seen = set()
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            for document in self._load(documents):
+                source = document.metadata["source"]
+                seen.add(source)
+                page_hash = content_hash(document.page_content)
+                if sources.get(source, {}).get("hash") == page_hash:
+                    self.changes["unchanged"] += len(sources[source]["chunks"])
+                    continue
+
+                in_flight[pool.submit(split_document, document)] = (source, page_hash)
+                if len(in_flight) >= 2 * self.max_workers:
+                    self._collect(in_flight, chunks, FIRST_COMPLETED)
+            self._collect(in_flight, chunks, ALL_COMPLETED)
+
+        for source in [s for s in sources if s not in seen]:
+            ids = [chunk_id(source, s) for s in sources.pop(source)["chunks"]]
+            if ids:
+                self.changes["deleted"] += len(ids)
+                self._put("split", chunks, ("delete", ids))
+
+    def _flush(self, batch, batches):
+        vectors = self.embedding.embed_documents([text for _, _, text, _ in batch])
+        self.stats["embed"]["items"] += len(batch)
+        self._put(
+            "embed",
+            batches,
+            (
+                "upsert",
+                [id_ for _, id_, _, _ in batch],
+                [text for _, _, text, _ in batch],
+                [metadata for _, _, _, metadata in batch],
+                vectors,
+            ),
+        )
+
+    def _embed(self, chunks, batches):
+        batch = []
+        while True:
+            item = self._get("embed", chunks)
+            if item is _DONE:
+                break
+            if item[0] == "delete":
+                self._put("embed", batches, item)
+                continue
+            batch.append(item)
+            if len(batch) == self.batch_size:
+                self._flush(batch, batches)
+                batch = []
+        if batch:
+            self._flush(batch, batches)
+
+    def _upsert(self, batches):
+        while True:
+            item = self._get("upsert", batches)
+            if item is _DONE:
+                break
+            if item[0] == "delete":
+                self.vectorstore.delete(ids=item[1])
+            else:
+                _, ids, texts, metadatas, vectors = item
+                upsert(self.vectorstore, ids, texts, metadatas, vectors)
+                self.stats["upsert"]["items"] += len(ids)
+
+    def _run_stage(self, stage, target, *args, out=None):
+        start = time.perf_counter()
+        try:
+            target(*args)
+            if out is not None:
+                self._put(stage, out, _DONE)
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._failed.set()
+        finally:
+            self.stats[stage]["seconds"] = time.perf_counter() - start
+
+    def run(self, documents):
+        """Ingest an iterable of documents, returning the changes made."""
+        chunks = queue.Queue(maxsize=self.queue_size)
+        batches = queue.Queue(maxsize=max(1, self.queue_size // self.batch_size))
+        threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=("split", self._split, documents, chunks),
+                kwargs={"out": chunks},
+            ),
+            threading.Thread(
+                target=self._run_stage,
+                args=("embed", self._embed, chunks, batches),
+                kwargs={"out": batches},
+            ),
+        ]
+        for thread in threads:
+            thread.start()
+        self._run_stage("upsert", self._upsert, batches)
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+        return self.changes
+
+    def report(self):
+        """Describe the throughput of every stage."""
+        lines = []
+        for stage in STAGES:
+            stats = self.stats[stage]
+            rate = stats["items"] / stats["seconds"] if stats["seconds"] else 0.0
+            lines.append(
+                f"{stage:>6}: {stats['items']} items in {stats['seconds']:.2f}s "
+                f"({rate:.1f}/s), waited {stats['waiting']:.2f}s for input, "
+                f"blocked {stats['blocked']:.2f}s on output"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,16 @@
+"""RAG prompt, vendored from LangChain Hub so that startup needs no network."""
+from langchain.prompts import ChatPromptTemplate
+
+
+# Copy of https://smith.langchain.com/hub/rlm/rag-prompt
+TEMPLATE = (
+    "You are an assistant for question-answering tasks. Use the following pieces "
+    "of retrieved context to answer the question. If you don't know the answer, "
+    "just say that you don't know. Use three sentences maximum and keep the "
+    "answer concise.\n"
+    "Question: {question} \n"
+    "Context: {context} \n"
+    "Answer:"
+)
+
+PROMPT = ChatPromptTemplate.from_messages([("human", TEMPLATE)])
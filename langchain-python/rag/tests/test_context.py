@@ -0,0 +1,36 @@
+"""Tests of the context packer."""
+import string
+
+from langchain_core.documents import Document
+import pytest
+
+from context import ContextPacker
+
+PAGE = "".join(string.ascii_letters[i % 52] * 10 for i in range(260))
+
+
+def chunk(start, source="page"):
+    """Get the chunk of the page at a start index, 1000 characters long."""
+    return Document(
+        page_content=PAGE[start : start + 1000],
+        metadata={"source": source, "start_index": start},
+    )
+
+
+@pytest.mark.parametrize("order", [[2, 0, 1], [0, 2, 1], [1, 2, 0]])
+def test_pack_merges_chunks_retrieved_out_of_order(order):
+    """Chunks bridged by a later one end up in a single passage."""
+    chunks = [chunk(0), chunk(800), chunk(1600)]
+
+    passages = ContextPacker(max_tokens=10000).pack([chunks[i] for i in order])
+
+    assert passages == [("page", 0, PAGE[:2600])]
+
+
+def test_pack_skips_chunks_over_the_budget():
+    """A chunk is only added when the text it adds fits in the budget."""
+    packer = ContextPacker(max_tokens=450)
+
+    passages = packer.pack([chunk(800), chunk(0, "other"), chunk(0)])
+
+    assert passages == [("page", 0, PAGE[:1800])]
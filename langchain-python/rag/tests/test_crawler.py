@@ -0,0 +1,55 @@
+"""Tests of the crawler."""
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+
+from crawler import FetchCache, iter_crawl
+
+
+@pytest.fixture
+def website(tmp_path):
+    """Serve a page linking to 20 others, and get its URL."""
+    site = tmp_path / "site"
+    (site / "guides").mkdir(parents=True)
+    links = "".join(f'<a href="page{i}.html">Page {i}</a>' for i in range(20))
+    (site / "guides" / "index.html").write_text(f"<html><body>{links}</body></html>")
+    for i in range(20):
+        (site / "guides" / f"page{i}.html").write_text(f"<html>Page {i}</html>")
+
+    handler = partial(SimpleHTTPRequestHandler, directory=str(site))
+    handler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(("localhost", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://localhost:{server.server_port}/guides/"
+    server.shutdown()
+
+
+def crawler_threads():
+    """Get the threads running a crawl."""
+    return [t for t in threading.enumerate() if t.name.endswith("(run)")]
+
+
+def test_closing_the_documents_stops_the_crawl(website, tmp_path):
+    """A consumer stopping early doesn't leave the crawler blocked on the queue."""
+    documents = iter_crawl(
+        website, max_pending=1, cache=FetchCache(str(tmp_path / "cache"))
+    )
+    next(documents)
+    assert crawler_threads()
+
+    documents.close()
+    deadline = time.monotonic() + 10
+    while crawler_threads() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not crawler_threads()
+
+
+def test_all_documents_are_yielded(website, tmp_path):
+    """A consumer reading every document gets every page."""
+    documents = list(
+        iter_crawl(website, max_pending=1, cache=FetchCache(str(tmp_path / "cache")))
+    )
+    assert len(documents) == 21
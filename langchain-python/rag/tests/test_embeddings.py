@@ -0,0 +1,72 @@
+"""Tests of the embeddings cache."""
+from array import array
+import sqlite3
+
+from embeddings import CachedEmbeddings
+
+
+class FakeEmbeddings:
+    """Embeddings counting the texts they embed."""
+
+    model_name = "fake"
+
+    def __init__(self):
+        """Initialize the counter."""
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        """Embed texts as their length."""
+        self.calls += 1
+        return [[float(len(text)), 0.5] for text in texts]
+
+    def embed_query(self, text):
+        """Embed a query as its length."""
+        return self.embed_documents([text])[0]
+
+
+def test_vectors_are_stored_as_float32(tmp_path):
+    """The vectors take 4 bytes per dimension."""
+    path = str(tmp_path / "embeddings.db")
+    cache = CachedEmbeddings(FakeEmbeddings(), path=path)
+    assert cache.embed_documents(["abc"]) == [[3.0, 0.5]]
+
+    (vector,) = sqlite3.connect(path).execute("SELECT vector FROM embeddings").fetchone()
+    assert len(vector) == 2 * 4
+
+
+def test_float64_vectors_are_converted(tmp_path):
+    """A cache written with float64 vectors is converted when opened."""
+    path = str(tmp_path / "embeddings.db")
+    underlying = FakeEmbeddings()
+    cache = CachedEmbeddings(underlying, path=path)
+    key = cache._key("document", "abc")
+    db = sqlite3.connect(path)
+    db.execute(
+        "INSERT INTO embeddings VALUES (?, ?, 1)",
+        (key, array("d", [3.0, 0.5]).tobytes()),
+    )
+    db.execute("PRAGMA user_version = 0")
+    db.commit()
+
+    cache = CachedEmbeddings(underlying, path=path)
+    assert cache.embed_documents(["abc"]) == [[3.0, 0.5]]
+    assert underlying.calls == 0
+
+
+def test_hits_only_read_the_cache(tmp_path):
+    """The recency of the hits is written in batches, not on every lookup."""
+    path = str(tmp_path / "embeddings.db")
+    cache = CachedEmbeddings(FakeEmbeddings(), path=path, flush_interval=3600)
+    cache.embed_documents(["abc"])
+    cache.embed_query("abc")
+    changes = cache._db.total_changes
+
+    for _ in range(10):
+        assert cache.embed_query("abc") == [3.0, 0.5]
+        cache.embed_documents(["abc"])
+    assert cache._db.total_changes == changes
+    assert not cache._db.in_transaction
+
+    cache.flush_interval = 0
+    cache.embed_documents(["abc"])
+    assert cache._db.total_changes == changes + 2
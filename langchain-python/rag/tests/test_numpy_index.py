@@ -0,0 +1,44 @@
+"""Tests of the NumPy vector index."""
+import numpy as np
+
+from numpy_index import NumpyIndex
+
+
+class FakeEmbeddings:
+    """Embeddings given by the test, for the queries."""
+
+    def embed_query(self, text):
+        """Embed a query, as a vector along its first word's axis."""
+        return {"a": [1.0, 0.0, 0.0], "b": [0.0, 1.0, 0.0]}[text.split()[0]]
+
+
+def test_upsert_keeps_the_last_duplicate_of_a_batch():
+    """An id appearing twice in one batch keeps its last chunk and vector."""
+    index = NumpyIndex(FakeEmbeddings())
+    index.upsert(
+        ["1", "2", "1"],
+        ["a first", "b", "b second"],
+        [{}, {}, {"version": 2}],
+        [[1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [0.0, 1.0, 0.0]],
+    )
+
+    assert len(index) == 2
+    assert index._matrix().shape == (2, 3)
+    document, score = index.similarity_search_with_score("b", k=1)[0]
+    assert (document.page_content, document.metadata) == ("b second", {"version": 2})
+    assert np.isclose(score, 1.0)
+
+
+def test_upsert_replaces_a_saved_chunk(tmp_path):
+    """An id already in a saved index is replaced in place."""
+    index = NumpyIndex(FakeEmbeddings(), path=str(tmp_path))
+    index.upsert(["1"], ["a"], [{}], [[1.0, 0.0, 0.0]])
+    index.save()
+
+    index = NumpyIndex(FakeEmbeddings(), path=str(tmp_path))
+    index.upsert(["1", "1"], ["a", "b"], [{}, {}], [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+
+    assert len(index) == 1
+    document, score = index.similarity_search_with_score("b", k=1)[0]
+    assert document.page_content == "b"
+    assert np.isclose(score, 1.0)